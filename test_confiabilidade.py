@@ -16,13 +16,21 @@ Testes realizados:
 
 import os
 import sys
+import json
 import sqlite3
 import shutil
-import time
 from pathlib import Path
 from datetime import datetime
 import tempfile
-import xml.etree.ElementTree as ET
+
+# Valores inteiros de ProcessingStatus persistidos pelo xml_organizer
+# (ver STATUS_NAMES no módulo principal)
+SUCCESS_STATUS = 6
+STATUS_NAMES = {
+    0: 'PENDING', 1: 'QUARANTINED', 2: 'PROCESSING', 3: 'PARSED',
+    4: 'DB_INSERTED', 5: 'FILE_MOVED', 6: 'SUCCESS', 7: 'FAILED_PARSING',
+    8: 'FAILED_DB', 9: 'FAILED_MOVE', 10: 'FAILED_PERMANENT', 11: 'DUPLICATE',
+}
 
 # Cores para output
 class Colors:
@@ -301,7 +309,6 @@ def test_audit_logging():
         print_success(f"Arquivo de auditoria legível: {len(lines)} linhas")
         
         # Verificar formato JSON
-        import json
         if lines:
             last_line = lines[-1].strip()
             if last_line:
@@ -447,7 +454,7 @@ def test_processing_audit():
             
             print("\n  Distribuição por status:")
             for status, count in cursor.fetchall():
-                print(f"    {status}: {count}")
+                print(f"    {STATUS_NAMES.get(status, status)}: {count}")
             
             # Tentativas
             cursor.execute("""
@@ -487,8 +494,8 @@ def test_performance_metrics():
         cursor.execute("""
             SELECT AVG(total_duration_ms), MAX(total_duration_ms), MIN(total_duration_ms)
             FROM processing_audit
-            WHERE current_status = 'SUCCESS' AND total_duration_ms IS NOT NULL
-        """)
+            WHERE current_status = ? AND total_duration_ms IS NOT NULL
+        """, (SUCCESS_STATUS,))
         
         result = cursor.fetchone()
         if result and result[0]:
@@ -511,7 +518,7 @@ def test_performance_metrics():
         cursor.execute("""
             SELECT 
                 COUNT(*) as total,
-                SUM(CASE WHEN current_status = 'SUCCESS' THEN 1 ELSE 0 END) as success
+                SUM(CASE WHEN current_status = 6 THEN 1 ELSE 0 END) as success
             FROM processing_audit
         """)
         
@@ -559,7 +566,7 @@ def main():
         try:
             result = test_func()
             results.append((name, result))
-            time.sleep(0.5)  # Pausa entre testes
+            sys.stdout.flush()
         except Exception as e:
             print_error(f"Erro no teste '{name}': {e}")
             results.append((name, False))
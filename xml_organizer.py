@@ -1,1163 +1,2195 @@
-"""
-XML Organizer - Versão Ultra-Confiável
-======================================
-
-Sistema com garantia de processamento de 100% dos XMLs com múltiplas camadas
-de proteção, auditoria completa e recovery automático.
-
-Principais melhorias de confiabilidade:
-- Quarentena antes de processar (staging area)
-- Retry automático com backoff exponencial
-- Transações atômicas (BD + movimentação de arquivo)
-- Auditoria completa de todas as tentativas
-- Recovery automático em caso de falha
-- Dead Letter Queue para casos irrecuperáveis
-- Reconciliação periódica para detectar inconsistências
-"""
-
-import os
-import shutil
-import xml.etree.ElementTree as ET
-from pathlib import Path
-from datetime import datetime, timedelta
-import logging
-import sqlite3
-import re
-import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from threading import Lock
-import hashlib
-import json
-from enum import Enum
-from typing import Optional, Dict, Tuple, List
-from dataclasses import dataclass, asdict
-import traceback
-
-# ============================================================================
-# CONFIGURAÇÃO
-# ============================================================================
-
-# Para WSL
-SOURCE_DIRECTORY = Path("/mnt/c/Automations")
-DESTINATION_NETWORK_DIRECTORY = Path("/mnt/r/XML_ASINCRONIZAR/ZZZ_XML_BOT")
-
-# Diretórios de trabalho (CRÍTICO para confiabilidade)
-QUARANTINE_DIRECTORY = Path("/mnt/c/xml_organizer_data/quarantine")
-PROCESSING_DIRECTORY = Path("/mnt/c/xml_organizer_data/processing")
-FAILED_DIRECTORY = Path("/mnt/c/xml_organizer_data/failed")
-DEAD_LETTER_DIRECTORY = Path("/mnt/c/xml_organizer_data/dead_letter")
-
-# Banco de dados e logs
-DATABASE_FILE = "/mnt/c/xml_organizer_data/xml_organizer.db"
-LOG_FILE = "/mnt/c/xml_organizer_data/xml_organizer.log"
-AUDIT_LOG_FILE = "/mnt/c/xml_organizer_data/audit.log"
-
-# Parâmetros de processamento
-MAX_WORKERS = 4  # Reduzido para maior controle
-SCAN_INTERVAL = 30
-BATCH_SIZE = 50  # Reduzido para commits mais frequentes
-MAX_RETRY_ATTEMPTS = 5
-RETRY_DELAY_BASE = 2  # segundos (crescimento exponencial)
-RECONCILIATION_INTERVAL = 300  # 5 minutos
-
-# Criar diretórios necessários
-for directory in [
-    Path(DATABASE_FILE).parent,
-    QUARANTINE_DIRECTORY,
-    PROCESSING_DIRECTORY,
-    FAILED_DIRECTORY,
-    DEAD_LETTER_DIRECTORY,
-    DESTINATION_NETWORK_DIRECTORY / "_ERROS"
-]:
-    directory.mkdir(parents=True, exist_ok=True)
-
-# ============================================================================
-# LOGGING APRIMORADO
-# ============================================================================
-
-# Logger principal
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s [%(levelname)s] [%(name)s] %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S',
-    handlers=[
-        logging.FileHandler(LOG_FILE, encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
-logger = logging.getLogger('XMLOrganizer')
-
-# Logger de auditoria (separado, nunca é rotacionado)
-audit_logger = logging.getLogger('Audit')
-audit_logger.setLevel(logging.INFO)
-audit_handler = logging.FileHandler(AUDIT_LOG_FILE, encoding='utf-8')
-audit_handler.setFormatter(logging.Formatter(
-    '%(asctime)s [AUDIT] %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
-))
-audit_logger.addHandler(audit_handler)
-audit_logger.propagate = False
-
-# ============================================================================
-# ENUMS E DATACLASSES
-# ============================================================================
-
-class ProcessingStatus(Enum):
-    """Status de processamento de um arquivo."""
-    PENDING = "PENDING"              # Na fila para processar
-    QUARANTINED = "QUARANTINED"      # Movido para quarentena
-    PROCESSING = "PROCESSING"        # Em processamento
-    PARSED = "PARSED"                # XML parseado com sucesso
-    DB_INSERTED = "DB_INSERTED"      # Inserido no banco
-    FILE_MOVED = "FILE_MOVED"        # Arquivo movido
-    SUCCESS = "SUCCESS"              # Completamente processado
-    FAILED_PARSING = "FAILED_PARSING"          # Falha ao parsear XML
-    FAILED_DB = "FAILED_DB"                    # Falha no banco
-    FAILED_MOVE = "FAILED_MOVE"                # Falha ao mover arquivo
-    FAILED_PERMANENT = "FAILED_PERMANENT"      # Falha permanente (dead letter)
-    DUPLICATE = "DUPLICATE"          # Arquivo duplicado
-
-class ErrorType(Enum):
-    """Tipos de erro possíveis."""
-    XML_PARSE_ERROR = "XML_PARSE_ERROR"
-    XML_INVALID_STRUCTURE = "XML_INVALID_STRUCTURE"
-    DB_CONNECTION_ERROR = "DB_CONNECTION_ERROR"
-    DB_INTEGRITY_ERROR = "DB_INTEGRITY_ERROR"
-    FILE_NOT_FOUND = "FILE_NOT_FOUND"
-    FILE_PERMISSION_ERROR = "FILE_PERMISSION_ERROR"
-    NETWORK_ERROR = "NETWORK_ERROR"
-    UNKNOWN_ERROR = "UNKNOWN_ERROR"
-
-@dataclass
-class ProcessingAttempt:
-    """Registro de uma tentativa de processamento."""
-    attempt_number: int
-    timestamp: str
-    status: str
-    error_type: Optional[str] = None
-    error_message: Optional[str] = None
-    duration_ms: Optional[int] = None
-
-@dataclass
-class FileProcessingRecord:
-    """Registro completo de processamento de um arquivo."""
-    original_path: str
-    filename: str
-    file_hash: str
-    discovered_at: str
-    current_status: str
-    attempts: List[ProcessingAttempt]
-    final_destination: Optional[str] = None
-    chave_acesso: Optional[str] = None
-    empresa_id: Optional[int] = None
-
-# ============================================================================
-# LOCKS E CACHES
-# ============================================================================
-
-db_lock = Lock()
-cache_lock = Lock()
-company_cache = {}
-processed_hashes = set()
-processed_keys = set()
-
-# ============================================================================
-# SETUP DO BANCO DE DADOS APRIMORADO
-# ============================================================================
-
-def setup_database():
-    """Inicializa banco de dados com tabelas de auditoria."""
-    try:
-        conn = sqlite3.connect(DATABASE_FILE)
-        cursor = conn.cursor()
-        
-        # Tabela de empresas (mantida)
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS empresa (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            cnpj TEXT NOT NULL UNIQUE,
-            nome TEXT NOT NULL,
-            updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
-            created_at TEXT DEFAULT CURRENT_TIMESTAMP
-        )
-        ''')
-
-        # Tabela de notas fiscais (mantida)
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS nota_fiscal (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            chave_acesso TEXT NOT NULL UNIQUE,
-            hash_arquivo TEXT NOT NULL UNIQUE,
-            empresa_id INTEGER NOT NULL,
-            data_processamento TEXT NOT NULL,
-            data_emissao TEXT NOT NULL,
-            tipo_documento TEXT NOT NULL,
-            caminho_arquivo TEXT NOT NULL,
-            status TEXT DEFAULT 'PROCESSADO',
-            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (empresa_id) REFERENCES empresa (id)
-        )
-        ''')
-        
-        # NOVA: Tabela de auditoria de processamento
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS processing_audit (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            file_hash TEXT NOT NULL,
-            filename TEXT NOT NULL,
-            original_path TEXT NOT NULL,
-            discovered_at TEXT NOT NULL,
-            current_status TEXT NOT NULL,
-            attempt_count INTEGER DEFAULT 0,
-            last_attempt_at TEXT,
-            last_error_type TEXT,
-            last_error_message TEXT,
-            final_destination TEXT,
-            chave_acesso TEXT,
-            empresa_id INTEGER,
-            completed_at TEXT,
-            total_duration_ms INTEGER,
-            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-            updated_at TEXT DEFAULT CURRENT_TIMESTAMP
-        )
-        ''')
-        
-        # NOVA: Tabela de tentativas individuais
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS processing_attempts (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            audit_id INTEGER NOT NULL,
-            attempt_number INTEGER NOT NULL,
-            status TEXT NOT NULL,
-            error_type TEXT,
-            error_message TEXT,
-            stack_trace TEXT,
-            duration_ms INTEGER,
-            timestamp TEXT DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (audit_id) REFERENCES processing_audit (id)
-        )
-        ''')
-        
-        # NOVA: Tabela de reconciliação
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS reconciliation_log (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            run_at TEXT DEFAULT CURRENT_TIMESTAMP,
-            files_checked INTEGER,
-            inconsistencies_found INTEGER,
-            issues_fixed INTEGER,
-            details TEXT
-        )
-        ''')
-        
-        # Índices otimizados
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_chave_acesso ON nota_fiscal(chave_acesso)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_hash_arquivo ON nota_fiscal(hash_arquivo)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_empresa_cnpj ON empresa(cnpj)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_empresa_id ON nota_fiscal(empresa_id)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_data_emissao ON nota_fiscal(data_emissao)')
-        
-        # Índices para auditoria
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_audit_hash ON processing_audit(file_hash)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_audit_status ON processing_audit(current_status)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_audit_chave ON processing_audit(chave_acesso)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_attempts_audit ON processing_attempts(audit_id)')
-        
-        conn.commit()
-        conn.close()
-        logger.info("✓ Banco de dados inicializado com sistema de auditoria")
-    except Exception as e:
-        logger.critical(f"✗ Falha ao inicializar banco: {e}")
-        raise
-
-def migrate_old_database():
-    """Migra dados do banco antigo se existir."""
-    try:
-        conn = sqlite3.connect(DATABASE_FILE)
-        cursor = conn.cursor()
-        
-        # Verifica se há dados antigos para migrar
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
-        tables = [row[0] for row in cursor.fetchall()]
-        
-        if 'empresa' in tables and 'processing_audit' not in tables:
-            logger.info("→ Banco antigo detectado, criando tabelas de auditoria...")
-            setup_database()
-        
-        conn.close()
-    except Exception as e:
-        logger.warning(f"Aviso na migração: {e}")
-
-# ============================================================================
-# FUNÇÕES DE AUDITORIA
-# ============================================================================
-
-def audit_log(event: str, details: dict):
-    """Registra evento de auditoria (nunca falha)."""
-    try:
-        audit_logger.info(json.dumps({
-            'event': event,
-            'timestamp': datetime.now().isoformat(),
-            **details
-        }, ensure_ascii=False))
-    except Exception as e:
-        logger.error(f"Erro ao registrar auditoria: {e}")
-
-def create_processing_record(file_path: Path, file_hash: str) -> int:
-    """Cria registro inicial de processamento e retorna audit_id."""
-    try:
-        with db_lock:
-            conn = sqlite3.connect(DATABASE_FILE, timeout=30)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                INSERT INTO processing_audit 
-                (file_hash, filename, original_path, discovered_at, current_status, attempt_count)
-                VALUES (?, ?, ?, ?, ?, 0)
-            ''', (
-                file_hash,
-                file_path.name,
-                str(file_path),
-                datetime.now().isoformat(),
-                ProcessingStatus.PENDING.value
-            ))
-            
-            audit_id = cursor.lastrowid
-            conn.commit()
-            conn.close()
-            
-            audit_log('FILE_DISCOVERED', {
-                'audit_id': audit_id,
-                'filename': file_path.name,
-                'hash': file_hash
-            })
-            
-            return audit_id
-            
-    except Exception as e:
-        logger.error(f"Erro ao criar registro de processamento: {e}")
-        return None
-
-def update_processing_status(audit_id: int, status: ProcessingStatus, 
-                            error_type: Optional[ErrorType] = None,
-                            error_message: Optional[str] = None,
-                            **kwargs):
-    """Atualiza status de processamento."""
-    try:
-        with db_lock:
-            conn = sqlite3.connect(DATABASE_FILE, timeout=30)
-            cursor = conn.cursor()
-            
-            update_fields = {
-                'current_status': status.value,
-                'updated_at': datetime.now().isoformat()
-            }
-            
-            if error_type:
-                update_fields['last_error_type'] = error_type.value
-            if error_message:
-                update_fields['last_error_message'] = error_message[:500]  # Limita tamanho
-            
-            update_fields.update(kwargs)
-            
-            set_clause = ', '.join([f"{k} = ?" for k in update_fields.keys()])
-            values = list(update_fields.values()) + [audit_id]
-            
-            cursor.execute(f'''
-                UPDATE processing_audit 
-                SET {set_clause}
-                WHERE id = ?
-            ''', values)
-            
-            conn.commit()
-            conn.close()
-            
-    except Exception as e:
-        logger.error(f"Erro ao atualizar status: {e}")
-
-def record_attempt(audit_id: int, attempt_number: int, status: ProcessingStatus,
-                  error_type: Optional[ErrorType] = None,
-                  error_message: Optional[str] = None,
-                  stack_trace: Optional[str] = None,
-                  duration_ms: Optional[int] = None):
-    """Registra tentativa individual de processamento."""
-    try:
-        with db_lock:
-            conn = sqlite3.connect(DATABASE_FILE, timeout=30)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                INSERT INTO processing_attempts
-                (audit_id, attempt_number, status, error_type, error_message, stack_trace, duration_ms)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                audit_id,
-                attempt_number,
-                status.value,
-                error_type.value if error_type else None,
-                error_message[:500] if error_message else None,
-                stack_trace[:2000] if stack_trace else None,
-                duration_ms
-            ))
-            
-            # Atualiza contador de tentativas
-            cursor.execute('''
-                UPDATE processing_audit
-                SET attempt_count = attempt_count + 1,
-                    last_attempt_at = CURRENT_TIMESTAMP
-                WHERE id = ?
-            ''', (audit_id,))
-            
-            conn.commit()
-            conn.close()
-            
-            audit_log('PROCESSING_ATTEMPT', {
-                'audit_id': audit_id,
-                'attempt': attempt_number,
-                'status': status.value,
-                'error': error_type.value if error_type else None
-            })
-            
-    except Exception as e:
-        logger.error(f"Erro ao registrar tentativa: {e}")
-
-# ============================================================================
-# FUNÇÕES AUXILIARES (mantidas do original)
-# ============================================================================
-
-def calculate_file_hash(file_path: Path) -> Optional[str]:
-    """Calcula hash MD5 do arquivo."""
-    hash_md5 = hashlib.md5()
-    try:
-        with open(file_path, "rb") as f:
-            for chunk in iter(lambda: f.read(65536), b""):
-                hash_md5.update(chunk)
-        return hash_md5.hexdigest()
-    except Exception as e:
-        logger.error(f"Erro ao calcular hash de {file_path.name}: {e}")
-        return None
-
-def standardize_company_name(name: str) -> str:
-    """Padroniza nome da empresa."""
-    name = re.sub(r'[.\-/\\]', '', name)
-    name = re.sub(r'\s+', ' ', name).strip()
-    return name.upper()
-
-def get_or_create_company(cnpj: str, nome_xml: str) -> int:
-    """Obtém ou cria empresa no banco."""
-    nome_padronizado = standardize_company_name(nome_xml)
-    
-    with cache_lock:
-        if cnpj in company_cache:
-            cached = company_cache[cnpj]
-            if cached["nome"] != nome_padronizado:
-                with db_lock:
-                    conn = sqlite3.connect(DATABASE_FILE, timeout=10)
-                    cursor = conn.cursor()
-                    cursor.execute(
-                        "UPDATE empresa SET nome = ?, updated_at = CURRENT_TIMESTAMP WHERE cnpj = ?",
-                        (nome_padronizado, cnpj)
-                    )
-                    conn.commit()
-                    conn.close()
-                company_cache[cnpj]["nome"] = nome_padronizado
-            return cached["id"]
-        
-        with db_lock:
-            conn = sqlite3.connect(DATABASE_FILE, timeout=10)
-            cursor = conn.cursor()
-            cursor.execute("SELECT id, nome FROM empresa WHERE cnpj = ?", (cnpj,))
-            result = cursor.fetchone()
-            
-            if result:
-                company_id, nome_atual = result
-                if nome_atual != nome_padronizado:
-                    cursor.execute(
-                        "UPDATE empresa SET nome = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
-                        (nome_padronizado, company_id)
-                    )
-                    conn.commit()
-            else:
-                cursor.execute(
-                    "INSERT INTO empresa (cnpj, nome) VALUES (?, ?)",
-                    (cnpj, nome_padronizado)
-                )
-                conn.commit()
-                company_id = cursor.lastrowid
-            
-            conn.close()
-            company_cache[cnpj] = {"id": company_id, "nome": nome_padronizado}
-            return company_id
-
-def get_xml_info(xml_file: Path) -> Optional[dict]:
-    """Extrai informações do XML (mantida lógica original)."""
-    namespaces = [
-        {'nfe': 'http://www.portalfiscal.inf.br/nfe'},
-        {},
-    ]
-    
-    try:
-        tree = ET.parse(xml_file)
-        root = tree.getroot()
-
-        infNFe = None
-        for ns in namespaces:
-            infNFe = root.find('.//nfe:infNFe', ns) if ns else root.find('.//infNFe')
-            if infNFe is not None:
-                break
-        
-        if infNFe is None:
-            for elem in root.iter():
-                if elem.tag.endswith('infNFe'):
-                    infNFe = elem
-                    break
-        
-        if infNFe is None:
-            return None
-
-        chave_acesso = infNFe.get('Id', '').replace('NFe', '').replace('nfe', '')
-
-        ide = None
-        emit = None
-        for ns in namespaces:
-            if ns:
-                ide = infNFe.find('nfe:ide', ns)
-                emit = infNFe.find('nfe:emit', ns)
-            else:
-                ide = infNFe.find('ide')
-                emit = infNFe.find('emit')
-            if ide is not None and emit is not None:
-                break
-
-        if ide is None or emit is None:
-            return None
-
-        data_emissao_str = None
-        for tag_name in ['dhEmi', 'dEmi']:
-            for ns in namespaces:
-                elem = ide.find(f'nfe:{tag_name}', ns) if ns else ide.find(tag_name)
-                if elem is not None:
-                    data_emissao_str = elem.text.split('T')[0] if 'T' in elem.text else elem.text
-                    break
-            if data_emissao_str:
-                break
-        
-        if not data_emissao_str:
-            return None
-            
-        data_emissao_dt = datetime.strptime(data_emissao_str, '%Y-%m-%d')
-
-        modelo = None
-        for ns in namespaces:
-            mod_elem = ide.find('nfe:mod', ns) if ns else ide.find('mod')
-            if mod_elem is not None:
-                modelo = mod_elem.text
-                break
-        
-        tipo_documento = 'NFE' if modelo == '55' else 'NFCE' if modelo == '65' else f"MOD{modelo}"
-
-        cnpj = None
-        nome_empresa = None
-        for ns in namespaces:
-            cnpj_elem = emit.find('nfe:CNPJ', ns) if ns else emit.find('CNPJ')
-            nome_elem = emit.find('nfe:xNome', ns) if ns else emit.find('xNome')
-            if cnpj_elem is not None:
-                cnpj = cnpj_elem.text
-            if nome_elem is not None:
-                nome_empresa = nome_elem.text
-            if cnpj and nome_empresa:
-                break
-
-        if not cnpj or not nome_empresa:
-            return None
-
-        return {
-            "data_processamento": datetime.now().strftime('%Y-%m-%d'),
-            "data_emissao": data_emissao_dt.strftime('%Y-%m-%d'),
-            "chave_acesso": chave_acesso,
-            "empresa_nome_xml": nome_empresa,
-            "empresa_nome_padronizado": standardize_company_name(nome_empresa),
-            "cnpj": cnpj,
-            "tipo_documento": tipo_documento,
-            "ano_emissao": data_emissao_dt.strftime('%Y'),
-            "mes_ano_emissao": data_emissao_dt.strftime('%m-%Y'),
-            "dia_emissao": data_emissao_dt.strftime('%d')
-        }
-
-    except Exception as e:
-        logger.error(f"Erro ao parsear XML {xml_file.name}: {e}")
-        return None
-
-def load_caches():
-    """Carrega caches de empresas e arquivos processados."""
-    global company_cache, processed_hashes, processed_keys
-    
-    try:
-        conn = sqlite3.connect(DATABASE_FILE)
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT cnpj, id, nome FROM empresa")
-        for cnpj, empresa_id, nome in cursor.fetchall():
-            company_cache[cnpj] = {"id": empresa_id, "nome": nome}
-        
-        cursor.execute("SELECT hash_arquivo, chave_acesso FROM nota_fiscal")
-        for hash_arq, chave in cursor.fetchall():
-            processed_hashes.add(hash_arq)
-            processed_keys.add(chave)
-        
-        conn.close()
-        logger.info(f"✓ Cache: {len(company_cache)} empresas, {len(processed_hashes)} registros")
-    except Exception as e:
-        logger.error(f"Erro ao carregar cache: {e}")
-
-# ============================================================================
-# PROCESSAMENTO COM RETRY E TRANSAÇÃO ATÔMICA
-# ============================================================================
-
-def move_to_quarantine(source: Path) -> Optional[Path]:
-    """
-    Move arquivo para quarentena ANTES de processar.
-    CRÍTICO: Garante que arquivo não seja perdido se algo der errado.
-    """
-    try:
-        # Nome único com timestamp para evitar conflitos
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
-        quarantine_file = QUARANTINE_DIRECTORY / f"{timestamp}_{source.name}"
-        
-        shutil.move(str(source), str(quarantine_file))
-        audit_log('FILE_QUARANTINED', {
-            'original': str(source),
-            'quarantine': str(quarantine_file)
-        })
-        return quarantine_file
-        
-    except Exception as e:
-        logger.error(f"CRÍTICO: Falha ao mover para quarentena {source.name}: {e}")
-        audit_log('QUARANTINE_FAILED', {
-            'file': str(source),
-            'error': str(e)
-        })
-        return None
-
-def atomic_process_file(quarantine_file: Path, audit_id: int, attempt_number: int) -> Tuple[bool, Optional[str], Optional[ErrorType]]:
-    """
-    Processa arquivo de forma atômica com rollback em caso de falha.
-    
-    Returns:
-        (success, error_message, error_type)
-    """
-    start_time = time.time()
-    conn = None
-    empresa_id = None
-    chave_acesso = None
-    destination_path = None
-    
-    try:
-        # FASE 1: Calcular hash
-        file_hash = calculate_file_hash(quarantine_file)
-        if not file_hash:
-            return False, "Falha ao calcular hash", ErrorType.FILE_NOT_FOUND
-        
-        # Verificar duplicata por hash
-        if file_hash in processed_hashes:
-            update_processing_status(audit_id, ProcessingStatus.DUPLICATE)
-            quarantine_file.unlink()
-            return True, "Duplicado (hash)", None  # Sucesso (arquivo já processado)
-        
-        # FASE 2: Parsear XML
-        info = get_xml_info(quarantine_file)
-        if not info:
-            return False, "XML inválido ou incompleto", ErrorType.XML_INVALID_STRUCTURE
-        
-        chave_acesso = info["chave_acesso"]
-        
-        # Verificar duplicata por chave
-        if chave_acesso in processed_keys:
-            update_processing_status(audit_id, ProcessingStatus.DUPLICATE, chave_acesso=chave_acesso)
-            quarantine_file.unlink()
-            return True, "Duplicado (chave)", None
-        
-        update_processing_status(audit_id, ProcessingStatus.PARSED, chave_acesso=chave_acesso)
-        
-        # FASE 3: Obter/criar empresa
-        empresa_id = get_or_create_company(info["cnpj"], info["empresa_nome_xml"])
-        nome_empresa_final = company_cache[info["cnpj"]]["nome"]
-        info["empresa_nome_padronizado"] = nome_empresa_final
-        
-        # FASE 4: Preparar destino
-        destination_path = (
-            DESTINATION_NETWORK_DIRECTORY /
-            f"{nome_empresa_final} - {info['cnpj']}" /
-            info['tipo_documento'] /
-            info['ano_emissao'] /
-            info['mes_ano_emissao'] /
-            info['dia_emissao'] /
-            quarantine_file.name
-        )
-        
-        # Verificar se destino já existe (duplicata)
-        if destination_path.exists():
-            update_processing_status(audit_id, ProcessingStatus.DUPLICATE, 
-                                    chave_acesso=chave_acesso, 
-                                    empresa_id=empresa_id)
-            quarantine_file.unlink()
-            return True, "Duplicado (destino existe)", None
-        
-        # FASE 5: TRANSAÇÃO ATÔMICA - BD + Movimentação
-        # Tenta inserir no BD primeiro
-        conn = sqlite3.connect(DATABASE_FILE, timeout=30)
-        cursor = conn.cursor()
-        
-        try:
-            cursor.execute('''
-                INSERT INTO nota_fiscal 
-                (chave_acesso, hash_arquivo, empresa_id, data_processamento, 
-                 data_emissao, tipo_documento, caminho_arquivo)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                chave_acesso,
-                file_hash,
-                empresa_id,
-                info["data_processamento"],
-                info["data_emissao"],
-                info["tipo_documento"],
-                str(destination_path)
-            ))
-            
-            # Commit no BD
-            conn.commit()
-            update_processing_status(audit_id, ProcessingStatus.DB_INSERTED,
-                                    chave_acesso=chave_acesso,
-                                    empresa_id=empresa_id)
-            
-        except sqlite3.IntegrityError as e:
-            conn.rollback()
-            update_processing_status(audit_id, ProcessingStatus.DUPLICATE)
-            quarantine_file.unlink()
-            return True, f"Duplicado (BD): {e}", None
-        
-        except Exception as e:
-            conn.rollback()
-            return False, f"Erro BD: {e}", ErrorType.DB_CONNECTION_ERROR
-        
-        finally:
-            if conn:
-                conn.close()
-        
-        # FASE 6: Mover arquivo físico
-        try:
-            destination_path.parent.mkdir(parents=True, exist_ok=True)
-            shutil.move(str(quarantine_file), str(destination_path))
-            
-            update_processing_status(
-                audit_id, 
-                ProcessingStatus.FILE_MOVED,
-                final_destination=str(destination_path)
-            )
-            
-        except Exception as e:
-            # ROLLBACK: Remover do BD se falhou ao mover arquivo
-            logger.error(f"CRÍTICO: Falha ao mover arquivo, fazendo rollback do BD: {e}")
-            
-            try:
-                conn = sqlite3.connect(DATABASE_FILE, timeout=30)
-                cursor = conn.cursor()
-                cursor.execute("DELETE FROM nota_fiscal WHERE chave_acesso = ?", (chave_acesso,))
-                conn.commit()
-                conn.close()
-                logger.info(f"✓ Rollback do BD executado com sucesso")
-            except Exception as rollback_error:
-                logger.critical(f"FALHA NO ROLLBACK: {rollback_error}")
-            
-            return False, f"Erro ao mover: {e}", ErrorType.FILE_PERMISSION_ERROR
-        
-        # FASE 7: Atualizar caches
-        processed_hashes.add(file_hash)
-        processed_keys.add(chave_acesso)
-        
-        # FASE 8: Marcar como sucesso
-        duration_ms = int((time.time() - start_time) * 1000)
-        update_processing_status(
-            audit_id,
-            ProcessingStatus.SUCCESS,
-            final_destination=str(destination_path),
-            completed_at=datetime.now().isoformat(),
-            total_duration_ms=duration_ms
-        )
-        
-        audit_log('FILE_PROCESSED_SUCCESS', {
-            'audit_id': audit_id,
-            'chave': chave_acesso,
-            'empresa_id': empresa_id,
-            'destination': str(destination_path),
-            'duration_ms': duration_ms
-        })
-        
-        return True, None, None
-        
-    except Exception as e:
-        error_msg = f"Erro inesperado: {str(e)}"
-        stack = traceback.format_exc()
-        logger.error(f"{error_msg}\n{stack}")
-        return False, error_msg, ErrorType.UNKNOWN_ERROR
-
-def process_single_file_with_retry(source_file: Path) -> dict:
-    """
-    Processa um arquivo com retry automático e auditoria completa.
-    
-    Fluxo:
-    1. Calcula hash inicial
-    2. Cria registro de auditoria
-    3. Move para quarentena (staging)
-    4. Tenta processar com retry exponencial
-    5. Se falhar permanentemente, move para dead letter
-    """
-    result = {
-        "file": source_file.name,
-        "status": "erro",
-        "audit_id": None,
-        "attempts": 0
-    }
-    
-    try:
-        # 1. Hash inicial (enquanto ainda está no source)
-        file_hash = calculate_file_hash(source_file)
-        if not file_hash:
-            logger.error(f"Impossível calcular hash: {source_file.name}")
-            return result
-        
-        # 2. Criar registro de auditoria
-        audit_id = create_processing_record(source_file, file_hash)
-        if not audit_id:
-            logger.error(f"Impossível criar registro de auditoria: {source_file.name}")
-            return result
-        
-        result["audit_id"] = audit_id
-        
-        # 3. Mover para quarentena (CRÍTICO)
-        quarantine_file = move_to_quarantine(source_file)
-        if not quarantine_file:
-            update_processing_status(audit_id, ProcessingStatus.FAILED_PERMANENT,
-                                    error_type=ErrorType.FILE_PERMISSION_ERROR,
-                                    error_message="Falha ao mover para quarentena")
-            return result
-        
-        update_processing_status(audit_id, ProcessingStatus.QUARANTINED)
-        
-        # 4. Tentar processar com retry
-        for attempt in range(1, MAX_RETRY_ATTEMPTS + 1):
-            result["attempts"] = attempt
-            
-            logger.info(f"→ Processando {quarantine_file.name} (tentativa {attempt}/{MAX_RETRY_ATTEMPTS})")
-            
-            update_processing_status(audit_id, ProcessingStatus.PROCESSING)
-            
-            success, error_msg, error_type = atomic_process_file(quarantine_file, audit_id, attempt)
-            
-            # Registrar tentativa
-            status = ProcessingStatus.SUCCESS if success else ProcessingStatus.FAILED_MOVE
-            record_attempt(audit_id, attempt, status, error_type, error_msg,
-                         traceback.format_exc() if not success else None)
-            
-            if success:
-                result["status"] = "sucesso"
-                logger.info(f"✓ {quarantine_file.name} processado com sucesso")
-                return result
-            
-            # Se falhou, verificar se deve tentar novamente
-            if attempt < MAX_RETRY_ATTEMPTS:
-                delay = RETRY_DELAY_BASE ** attempt  # Backoff exponencial
-                logger.warning(f"⚠ Tentativa {attempt} falhou: {error_msg}. Tentando novamente em {delay}s...")
-                time.sleep(delay)
-            else:
-                # Esgotou tentativas
-                logger.error(f"✗ FALHA PERMANENTE após {MAX_RETRY_ATTEMPTS} tentativas: {quarantine_file.name}")
-                
-                # Mover para dead letter queue
-                dead_letter_file = DEAD_LETTER_DIRECTORY / quarantine_file.name
-                try:
-                    shutil.move(str(quarantine_file), str(dead_letter_file))
-                    update_processing_status(audit_id, ProcessingStatus.FAILED_PERMANENT,
-                                            error_type=error_type,
-                                            error_message=error_msg,
-                                            final_destination=str(dead_letter_file))
-                    
-                    audit_log('FILE_DEAD_LETTER', {
-                        'audit_id': audit_id,
-                        'file': quarantine_file.name,
-                        'attempts': MAX_RETRY_ATTEMPTS,
-                        'final_error': error_msg
-                    })
-                except Exception as e:
-                    logger.critical(f"CRÍTICO: Falha ao mover para dead letter: {e}")
-        
-        return result
-        
-    except Exception as e:
-        logger.error(f"Erro crítico no processamento de {source_file.name}: {e}")
-        logger.error(traceback.format_exc())
-        return result
-
-# ============================================================================
-# PROCESSAMENTO EM LOTE
-# ============================================================================
-
-def process_batch(xml_files: List[Path]) -> dict:
-    """Processa lote de arquivos com controle de erro."""
-    stats = {
-        "sucesso": 0,
-        "duplicado": 0,
-        "erro": 0,
-        "total_attempts": 0
-    }
-    
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        futures = {executor.submit(process_single_file_with_retry, f): f for f in xml_files}
-        
-        for future in as_completed(futures):
-            try:
-                result = future.result(timeout=60)  # Timeout maior devido aos retries
-                
-                stats["total_attempts"] += result.get("attempts", 0)
-                
-                if result["status"] == "sucesso":
-                    stats["sucesso"] += 1
-                elif "duplicado" in result.get("status", ""):
-                    stats["duplicado"] += 1
-                else:
-                    stats["erro"] += 1
-                    
-            except Exception as e:
-                stats["erro"] += 1
-                logger.error(f"Erro no future: {e}")
-    
-    return stats
-
-def scan_and_process():
-    """Escaneia diretório de origem e processa arquivos."""
-    if not SOURCE_DIRECTORY.exists():
-        logger.error(f"Diretório de origem não encontrado: {SOURCE_DIRECTORY}")
-        return
-    
-    xml_files = list(SOURCE_DIRECTORY.rglob("*.xml"))
-    
-    if not xml_files:
-        return
-    
-    total = len(xml_files)
-    logger.info(f"→ {total} arquivo(s) encontrado(s)")
-    
-    start_time = time.time()
-    total_stats = {"sucesso": 0, "duplicado": 0, "erro": 0, "total_attempts": 0}
-    batch_num = 0
-    
-    for i in range(0, total, BATCH_SIZE):
-        batch = xml_files[i:i+BATCH_SIZE]
-        batch_num += 1
-        total_batches = (total + BATCH_SIZE - 1) // BATCH_SIZE
-        
-        stats = process_batch(batch)
-        
-        for key in total_stats:
-            total_stats[key] += stats[key]
-        
-        processed = total_stats["sucesso"] + total_stats["duplicado"] + total_stats["erro"]
-        elapsed = time.time() - start_time
-        rate = processed / elapsed if elapsed > 0 else 0
-        
-        logger.info(
-            f"✓ Lote {batch_num}/{total_batches}: "
-            f"{stats['sucesso']} ok | {stats['duplicado']} dup | {stats['erro']} erro | "
-            f"{stats['total_attempts']} tentativas | {processed}/{total} ({rate:.1f} arq/s)"
-        )
-    
-    elapsed = time.time() - start_time
-    if processed > 0:
-        logger.info(
-            f"✓ CONCLUÍDO: {total_stats['sucesso']} novos | "
-            f"{total_stats['duplicado']} duplicados | {total_stats['erro']} erros | "
-            f"{total_stats['total_attempts']} tentativas | "
-            f"Tempo: {elapsed:.1f}s | Taxa: {total/elapsed:.1f} arq/s"
-        )
-
-# ============================================================================
-# RECONCILIAÇÃO E RECOVERY
-# ============================================================================
-
-def reconcile_processing_queue():
-    """
-    Verifica arquivos que ficaram presos em estados intermediários e tenta recuperá-los.
-    Executa periodicamente para garantir que nenhum arquivo seja esquecido.
-    """
-    try:
-        logger.info("🔍 Iniciando reconciliação...")
-        
-        issues_found = []
-        issues_fixed = 0
-        
-        # 1. Verificar arquivos em quarentena que não têm registro de processamento recente
-        quarantine_files = list(QUARANTINE_DIRECTORY.glob("*.xml"))
-        if quarantine_files:
-            logger.warning(f"⚠ {len(quarantine_files)} arquivo(s) em quarentena precisam atenção")
-            
-            for qfile in quarantine_files:
-                # Verificar quanto tempo está em quarentena
-                file_age_seconds = time.time() - qfile.stat().st_mtime
-                
-                if file_age_seconds > 300:  # Mais de 5 minutos
-                    logger.warning(f"⚠ Arquivo preso em quarentena: {qfile.name} ({file_age_seconds:.0f}s)")
-                    issues_found.append(f"Quarantine stuck: {qfile.name}")
-                    
-                    # Tentar processar novamente
-                    try:
-                        result = process_single_file_with_retry(qfile)
-                        if result["status"] == "sucesso":
-                            issues_fixed += 1
-                    except Exception as e:
-                        logger.error(f"Erro ao recuperar {qfile.name}: {e}")
-        
-        # 2. Verificar registros no BD com status intermediário
-        conn = sqlite3.connect(DATABASE_FILE)
-        cursor = conn.cursor()
-        
-        intermediate_statuses = [
-            ProcessingStatus.PENDING.value,
-            ProcessingStatus.QUARANTINED.value,
-            ProcessingStatus.PROCESSING.value,
-            ProcessingStatus.PARSED.value,
-            ProcessingStatus.DB_INSERTED.value
-        ]
-        
-        cursor.execute('''
-            SELECT id, filename, current_status, last_attempt_at, attempt_count
-            FROM processing_audit
-            WHERE current_status IN ({})
-            AND datetime(last_attempt_at) < datetime('now', '-10 minutes')
-        '''.format(','.join(['?'] * len(intermediate_statuses))), intermediate_statuses)
-        
-        stuck_records = cursor.fetchall()
-        
-        if stuck_records:
-            logger.warning(f"⚠ {len(stuck_records)} registro(s) com status intermediário antigo")
-            
-            for record_id, filename, status, last_attempt, attempt_count in stuck_records:
-                logger.warning(f"⚠ Registro preso: ID={record_id}, {filename}, status={status}")
-                issues_found.append(f"DB stuck: {filename} ({status})")
-                
-                # Verificar se arquivo ainda existe em algum lugar
-                # Se não existe, marcar como perdido
-                found = False
-                for directory in [QUARANTINE_DIRECTORY, PROCESSING_DIRECTORY, FAILED_DIRECTORY]:
-                    if (directory / filename).exists():
-                        found = True
-                        break
-                
-                if not found:
-                    logger.error(f"✗ Arquivo perdido: {filename} (ID={record_id})")
-                    cursor.execute('''
-                        UPDATE processing_audit
-                        SET current_status = ?, 
-                            last_error_message = 'Arquivo perdido durante reconciliação',
-                            updated_at = CURRENT_TIMESTAMP
-                        WHERE id = ?
-                    ''', (ProcessingStatus.FAILED_PERMANENT.value, record_id))
-        
-        # 3. Verificar dead letter queue
-        dead_letter_files = list(DEAD_LETTER_DIRECTORY.glob("*.xml"))
-        if dead_letter_files:
-            logger.warning(f"⚠ {len(dead_letter_files)} arquivo(s) em dead letter queue")
-            issues_found.append(f"Dead letter: {len(dead_letter_files)} files")
-        
-        conn.commit()
-        
-        # 4. Registrar resultado da reconciliação
-        cursor.execute('''
-            INSERT INTO reconciliation_log
-            (files_checked, inconsistencies_found, issues_fixed, details)
-            VALUES (?, ?, ?, ?)
-        ''', (
-            len(quarantine_files) + len(stuck_records),
-            len(issues_found),
-            issues_fixed,
-            json.dumps(issues_found, ensure_ascii=False)
-        ))
-        
-        conn.commit()
-        conn.close()
-        
-        if issues_found:
-            logger.warning(f"⚠ Reconciliação: {len(issues_found)} problema(s), {issues_fixed} corrigido(s)")
-        else:
-            logger.info("✓ Reconciliação: Nenhum problema encontrado")
-        
-        audit_log('RECONCILIATION_COMPLETED', {
-            'issues_found': len(issues_found),
-            'issues_fixed': issues_fixed,
-            'details': issues_found
-        })
-        
-    except Exception as e:
-        logger.error(f"Erro na reconciliação: {e}")
-        logger.error(traceback.format_exc())
-
-# ============================================================================
-# MAIN
-# ============================================================================
-
-def main():
-    """Loop principal do sistema."""
-    logger.info("=" * 80)
-    logger.info("XML ORGANIZER v3.0 - ULTRA-CONFIÁVEL")
-    logger.info(f"Monitorando: {SOURCE_DIRECTORY}")
-    logger.info(f"Destino: {DESTINATION_NETWORK_DIRECTORY}")
-    logger.info(f"Quarentena: {QUARANTINE_DIRECTORY}")
-    logger.info(f"Dead Letter: {DEAD_LETTER_DIRECTORY}")
-    logger.info(f"Banco de dados: {DATABASE_FILE}")
-    logger.info(f"Workers: {MAX_WORKERS} | Batch: {BATCH_SIZE} | Max Retry: {MAX_RETRY_ATTEMPTS}")
-    logger.info("=" * 80)
-    
-    setup_database()
-    migrate_old_database()
-    load_caches()
-    
-    logger.info("\n🛡️ CAMADAS DE PROTEÇÃO ATIVAS:")
-    logger.info("  1. ✓ Quarentena antes de processar")
-    logger.info("  2. ✓ Retry automático com backoff exponencial")
-    logger.info("  3. ✓ Transação atômica (BD + arquivo)")
-    logger.info("  4. ✓ Auditoria completa de tentativas")
-    logger.info("  5. ✓ Dead Letter Queue para falhas permanentes")
-    logger.info("  6. ✓ Reconciliação periódica")
-    logger.info("  7. ✓ Recovery automático\n")
-    
-    audit_log('SYSTEM_STARTED', {'version': '3.0'})
-    
-    cycle = 0
-    last_reconciliation = time.time()
-    
-    while True:
-        try:
-            cycle += 1
-            
-            # Processar arquivos
-            scan_and_process()
-            
-            # Reconciliação periódica
-            if time.time() - last_reconciliation > RECONCILIATION_INTERVAL:
-                reconcile_processing_queue()
-                last_reconciliation = time.time()
-            
-            time.sleep(SCAN_INTERVAL)
-            
-        except KeyboardInterrupt:
-            logger.info("\n⊗ Finalizando por solicitação do usuário")
-            audit_log('SYSTEM_STOPPED', {'reason': 'user_request', 'cycles': cycle})
-            break
-            
-        except Exception as e:
-            logger.error(f"✗ Erro no ciclo {cycle}: {e}")
-            logger.error(traceback.format_exc())
-            audit_log('SYSTEM_ERROR', {'cycle': cycle, 'error': str(e)})
-            time.sleep(10)
-
-if __name__ == "__main__":
-    main()
+"""
+XML Organizer - Versão Ultra-Confiável
+======================================
+
+Sistema com garantia de processamento de 100% dos XMLs com múltiplas camadas
+de proteção, auditoria completa e recovery automático.
+
+Principais melhorias de confiabilidade:
+- Quarentena antes de processar (staging area)
+- Retry automático com backoff exponencial
+- Transações atômicas (BD + movimentação de arquivo)
+- Auditoria completa de todas as tentativas
+- Recovery automático em caso de falha
+- Dead Letter Queue para casos irrecuperáveis
+- Reconciliação periódica para detectar inconsistências
+"""
+
+import errno
+import io
+import os
+import shutil
+import xml.etree.ElementTree as ET
+
+# lxml (libxml2, parser em C) é opcional: quando presente, o parse dos XMLs
+# usa iterparse com streaming e early-exit; sem ele, cai no ElementTree padrão.
+try:
+    from lxml import etree as lxml_etree
+except ImportError:
+    lxml_etree = None
+
+# watchdog (inotify) é opcional: quando presente, o loop principal é acordado
+# na hora em que um XML novo aparece, em vez de esperar o próximo polling.
+# Em /mnt/c (WSL) o inotify pode não funcionar — o polling continua como rede
+# de segurança em ambos os casos.
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+# orjson (encoder JSON em C) é opcional: acelera a serialização da auditoria.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+from pathlib import Path
+from datetime import datetime, timedelta
+import logging
+import logging.handlers
+import sqlite3
+import re
+import time
+from concurrent.futures import (
+    ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+)
+from collections import deque
+from threading import Lock, Thread, Event, local
+import atexit
+import queue
+import hashlib
+import json
+import math
+from enum import IntEnum
+from functools import lru_cache
+from typing import Optional, Dict, Tuple, List
+from dataclasses import dataclass
+import traceback
+
+# ============================================================================
+# CONFIGURAÇÃO
+# ============================================================================
+
+# Para WSL
+SOURCE_DIRECTORY = Path("/mnt/c/Automations")
+DESTINATION_NETWORK_DIRECTORY = Path("/mnt/r/XML_ASINCRONIZAR/ZZZ_XML_BOT")
+
+# Diretórios de trabalho (CRÍTICO para confiabilidade)
+QUARANTINE_DIRECTORY = Path("/mnt/c/xml_organizer_data/quarantine")
+PROCESSING_DIRECTORY = Path("/mnt/c/xml_organizer_data/processing")
+FAILED_DIRECTORY = Path("/mnt/c/xml_organizer_data/failed")
+DEAD_LETTER_DIRECTORY = Path("/mnt/c/xml_organizer_data/dead_letter")
+
+# Banco de dados e logs
+DATABASE_FILE = "/mnt/c/xml_organizer_data/xml_organizer.db"
+LOG_FILE = "/mnt/c/xml_organizer_data/xml_organizer.log"
+AUDIT_LOG_FILE = "/mnt/c/xml_organizer_data/audit.log"
+
+# Parâmetros de processamento
+# Workers de arquivo são I/O-bound (leitura, move, commits): o GIL é liberado
+# nessas chamadas, então vale mais threads que núcleos — limitado a 32 para
+# não saturar o drive de rede
+MAX_WORKERS = min(32, (os.cpu_count() or 4) * 4)
+SCAN_INTERVAL = 30
+MAX_SCAN_INTERVAL = 300  # teto do backoff quando não há arquivos
+BATCH_SIZE = 50  # Reduzido para commits mais frequentes
+BATCH_TIMEOUT = 600  # prazo duro (s) para um lote inteiro completar
+MAX_RETRY_ATTEMPTS = 5
+RETRY_DELAY_BASE = 2  # segundos (crescimento exponencial)
+RECONCILIATION_INTERVAL = 300  # 5 minutos
+BULK_MODE_THRESHOLD = 1000  # lote a partir do qual índices secundários são suspensos
+LARGE_FILE_THRESHOLD = 1024 * 1024  # acima disso, hash/parse em streaming
+
+# Criar diretórios necessários
+for directory in [
+    Path(DATABASE_FILE).parent,
+    QUARANTINE_DIRECTORY,
+    PROCESSING_DIRECTORY,
+    FAILED_DIRECTORY,
+    DEAD_LETTER_DIRECTORY,
+    DESTINATION_NETWORK_DIRECTORY / "_ERROS"
+]:
+    directory.mkdir(parents=True, exist_ok=True)
+
+# ============================================================================
+# LOGGING APRIMORADO
+# ============================================================================
+
+# Logger principal
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s [%(levelname)s] [%(name)s] %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S',
+    handlers=[
+        logging.FileHandler(LOG_FILE, encoding='utf-8'),
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger('XMLOrganizer')
+
+# Logger de auditoria (separado, nunca é rotacionado).
+# A escrita em disco fica numa thread própria (QueueListener): o worker só
+# enfileira o registro e nunca espera o FileHandler abrir/escrever/flushar.
+audit_logger = logging.getLogger('Audit')
+audit_logger.setLevel(logging.INFO)
+audit_handler = logging.FileHandler(AUDIT_LOG_FILE, encoding='utf-8')
+audit_handler.setFormatter(logging.Formatter(
+    '%(asctime)s [AUDIT] %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+))
+_audit_log_queue: "queue.Queue" = queue.Queue(-1)
+audit_logger.addHandler(logging.handlers.QueueHandler(_audit_log_queue))
+audit_logger.propagate = False
+_audit_listener = logging.handlers.QueueListener(_audit_log_queue, audit_handler)
+_audit_listener.start()
+
+# ============================================================================
+# ENUMS E DATACLASSES
+# ============================================================================
+
+class ProcessingStatus(IntEnum):
+    """
+    Status de processamento de um arquivo.
+
+    Persistido como inteiro: linhas menores no banco (1 byte vs ~15 chars),
+    comparações mais baratas em GROUP BY/IN e mais linhas por página B-tree.
+    Use STATUS_NAMES para exibição humana.
+    """
+    PENDING = 0           # Na fila para processar
+    QUARANTINED = 1       # Movido para quarentena
+    PROCESSING = 2        # Em processamento
+    PARSED = 3            # XML parseado com sucesso
+    DB_INSERTED = 4       # Inserido no banco
+    FILE_MOVED = 5        # Arquivo movido
+    SUCCESS = 6           # Completamente processado
+    FAILED_PARSING = 7    # Falha ao parsear XML
+    FAILED_DB = 8         # Falha no banco
+    FAILED_MOVE = 9       # Falha ao mover arquivo
+    FAILED_PERMANENT = 10 # Falha permanente (dead letter)
+    DUPLICATE = 11        # Arquivo duplicado
+
+class ErrorType(IntEnum):
+    """Tipos de erro possíveis (persistidos como inteiro)."""
+    XML_PARSE_ERROR = 0
+    XML_INVALID_STRUCTURE = 1
+    DB_CONNECTION_ERROR = 2
+    DB_INTEGRITY_ERROR = 3
+    FILE_NOT_FOUND = 4
+    FILE_PERMISSION_ERROR = 5
+    NETWORK_ERROR = 6
+    UNKNOWN_ERROR = 7
+
+# Nomes legíveis para logs e relatórios
+STATUS_NAMES = {s.value: s.name for s in ProcessingStatus}
+ERROR_NAMES = {e.value: e.name for e in ErrorType}
+
+@dataclass
+class ProcessingAttempt:
+    """Registro de uma tentativa de processamento."""
+    attempt_number: int
+    timestamp: str
+    status: str
+    error_type: Optional[str] = None
+    error_message: Optional[str] = None
+    duration_ms: Optional[int] = None
+
+    def to_dict(self) -> dict:
+        """Dict direto para serialização — evita a deep copy do asdict()."""
+        return {
+            'attempt_number': self.attempt_number,
+            'timestamp': self.timestamp,
+            'status': self.status,
+            'error_type': self.error_type,
+            'error_message': self.error_message,
+            'duration_ms': self.duration_ms,
+        }
+
+@dataclass
+class FileProcessingRecord:
+    """Registro completo de processamento de um arquivo."""
+    original_path: str
+    filename: str
+    file_hash: str
+    discovered_at: str
+    current_status: str
+    attempts: List[ProcessingAttempt]
+    final_destination: Optional[str] = None
+    chave_acesso: Optional[str] = None
+    empresa_id: Optional[int] = None
+
+    def to_dict(self) -> dict:
+        """Dict direto para serialização — evita a deep copy do asdict()."""
+        return {
+            'original_path': self.original_path,
+            'filename': self.filename,
+            'file_hash': self.file_hash,
+            'discovered_at': self.discovered_at,
+            'current_status': self.current_status,
+            'attempts': [a.to_dict() for a in self.attempts],
+            'final_destination': self.final_destination,
+            'chave_acesso': self.chave_acesso,
+            'empresa_id': self.empresa_id,
+        }
+
+# ============================================================================
+# SQL PRÉ-DEFINIDO (texto constante reaproveita o statement preparado)
+# ============================================================================
+
+SQL_INSERT_AUDIT = '''
+    INSERT INTO processing_audit
+    (file_hash, filename, original_path, discovered_at, current_status, attempt_count)
+    VALUES (?, ?, ?, ?, ?, 0)
+'''
+
+# UPDATE de forma fixa: o cache de statements do sqlite3 é chaveado pelo texto
+# do SQL, então um set_clause dinâmico forçaria um prepare novo a cada chamada.
+# COALESCE preserva o valor atual das colunas não informadas.
+SQL_UPDATE_STATUS = '''
+    UPDATE processing_audit
+    SET current_status = ?,
+        updated_at = strftime('%Y-%m-%dT%H:%M:%f', 'now', 'localtime'),
+        last_error_type = COALESCE(?, last_error_type),
+        last_error_message = COALESCE(?, last_error_message),
+        chave_acesso = COALESCE(?, chave_acesso),
+        empresa_id = COALESCE(?, empresa_id),
+        final_destination = COALESCE(?, final_destination),
+        completed_at = COALESCE(?, completed_at),
+        total_duration_ms = COALESCE(?, total_duration_ms)
+    WHERE id = ?
+'''
+
+# Um único round-trip para criar/atualizar empresa; o WHERE evita reescrever
+# a linha (e bater updated_at) quando o nome não mudou
+SQL_UPSERT_EMPRESA = '''
+    INSERT INTO empresa (cnpj, nome) VALUES (?, ?)
+    ON CONFLICT(cnpj) DO UPDATE SET
+        nome = excluded.nome,
+        updated_at = CURRENT_TIMESTAMP
+    WHERE empresa.nome != excluded.nome
+'''
+
+SQL_INSERT_ATTEMPT = '''
+    INSERT INTO processing_attempts
+    (audit_id, attempt_number, status, error_type, error_message, stack_trace, duration_ms)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+
+SQL_BUMP_ATTEMPTS = '''
+    UPDATE processing_audit
+    SET attempt_count = attempt_count + 1,
+        last_attempt_at = CURRENT_TIMESTAMP
+    WHERE id = ?
+'''
+
+# ON CONFLICT DO NOTHING faz da inserção o próprio teste de duplicata
+# (rowcount == 0), sem corrida entre pré-checagem e INSERT e sem o custo de
+# montar/capturar uma IntegrityError no caminho comum
+SQL_INSERT_NOTA = '''
+    INSERT INTO nota_fiscal
+    (chave_acesso, hash_arquivo, empresa_id, data_processamento,
+     data_emissao, tipo_documento, caminho_arquivo)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT DO NOTHING
+'''
+
+SQL_MARK_LOST = '''
+    UPDATE processing_audit
+    SET current_status = ?,
+        last_error_message = 'Arquivo perdido durante reconciliação',
+        updated_at = CURRENT_TIMESTAMP
+    WHERE id = ?
+'''
+
+# Statuses intermediários e SQL da reconciliação montados uma única vez no
+# import: a tupla é fixa, então os placeholders do IN também são — nenhuma
+# montagem de string por ciclo (e o texto estável aproveita o cache de
+# statements da conexão)
+_STUCK_STATUSES = (
+    ProcessingStatus.PENDING.value,
+    ProcessingStatus.QUARANTINED.value,
+    ProcessingStatus.PROCESSING.value,
+    ProcessingStatus.PARSED.value,
+    ProcessingStatus.DB_INSERTED.value,
+)
+_STUCK_PLACEHOLDERS = ','.join('?' * len(_STUCK_STATUSES))
+SQL_SELECT_STUCK = f'''
+    SELECT id, filename, current_status, last_attempt_at, attempt_count
+    FROM processing_audit
+    WHERE current_status IN ({_STUCK_PLACEHOLDERS})
+    AND last_attempt_at < ?
+'''
+SQL_COUNT_INTERMEDIATE = f'''
+    SELECT COUNT(*) FROM processing_audit
+    WHERE current_status IN ({_STUCK_PLACEHOLDERS})
+'''
+
+# ============================================================================
+# LOCKS E CACHES
+# ============================================================================
+
+db_lock = Lock()
+cache_lock = Lock()
+company_cache = {}
+
+# ============================================================================
+# SETUP DO BANCO DE DADOS APRIMORADO
+# ============================================================================
+
+def _configure_conn(conn: sqlite3.Connection) -> sqlite3.Connection:
+    """
+    Aplica PRAGMAs de performance em uma conexão recém-aberta.
+
+    WAL elimina o fsync do rollback-journal e permite leitores concorrentes
+    durante escritas; synchronous=NORMAL reduz fsyncs por commit (seguro em
+    WAL); cache e mmap maiores reduzem syscalls de leitura. O db_lock continua
+    necessário apenas para serializar escritores entre threads.
+    """
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA cache_size=-65536")       # 64 MB
+    cursor.execute("PRAGMA mmap_size=268435456")     # 256 MB
+    cursor.execute("PRAGMA busy_timeout=30000")
+    cursor.execute("PRAGMA wal_autocheckpoint=1000")
+    cursor.execute("PRAGMA journal_size_limit=67108864")  # WAL limitado a 64 MB
+    return conn
+
+def force_checkpoint():
+    """
+    Checkpoint completo do WAL. Chamado no shutdown para garantir que o
+    arquivo principal esteja íntegro e o recovery na próxima partida seja
+    imediato, sem WAL gigante para reaplicar.
+    """
+    try:
+        conn = _connect_db(timeout=10)
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.close()
+    except Exception as e:
+        logger.warning(f"Checkpoint final falhou: {e}")
+
+def _connect_db(timeout: float = 30) -> sqlite3.Connection:
+    """
+    Abre conexão com o banco já configurada com os PRAGMAs de performance.
+
+    cached_statements=512 (default 128) mantém os programas VDBE das queries
+    parametrizadas compilados entre chamadas; detect_types=0 evita o parse de
+    tipos por coluna no fetch — só usamos TEXT/INTEGER/REAL nativos.
+    """
+    conn = sqlite3.connect(
+        DATABASE_FILE,
+        timeout=timeout,
+        cached_statements=512,
+        detect_types=0,
+    )
+    return _configure_conn(conn)
+
+def _connect_db_readonly(timeout: float = 30) -> sqlite3.Connection:
+    """
+    Abre conexão somente-leitura (query_only) para threads de verificação.
+
+    Em WAL, leitores não bloqueiam o escritor nem uns aos outros, então cada
+    thread pode ter sua própria conexão; query_only permite ao SQLite pular
+    a preparação de locks de escrita.
+    """
+    conn = _connect_db(timeout=timeout)
+    conn.execute("PRAGMA query_only=1")
+    return conn
+
+# Conexão persistente por thread: cada connect() reabre arquivo, WAL e SHM
+# (3 syscalls de open) e reaplica PRAGMAs — caro demais para o caminho quente,
+# que faz meia dúzia de operações por arquivo. Em WAL, uma conexão por thread
+# é seguro e os leitores não se bloqueiam.
+_tls = local()
+_pooled_conns: List[sqlite3.Connection] = []
+_pooled_conns_lock = Lock()
+
+def get_conn() -> sqlite3.Connection:
+    """Retorna a conexão desta thread, criando-a (e registrando-a) na primeira chamada."""
+    conn = getattr(_tls, 'conn', None)
+    if conn is None:
+        conn = _connect_db()
+        _tls.conn = conn
+        with _pooled_conns_lock:
+            _pooled_conns.append(conn)
+    return conn
+
+def get_ro_conn() -> sqlite3.Connection:
+    """
+    Conexão somente-leitura persistente desta thread. Mesma justificativa do
+    get_conn(): reabrir a conexão a cada ciclo paga open de arquivo/WAL/SHM e
+    reaplicação de PRAGMAs, e joga fora o page cache aquecido.
+    """
+    conn = getattr(_tls, 'ro_conn', None)
+    if conn is None:
+        conn = _connect_db_readonly()
+        _tls.ro_conn = conn
+        with _pooled_conns_lock:
+            _pooled_conns.append(conn)
+    return conn
+
+def _close_pooled_conns():
+    with _pooled_conns_lock:
+        for conn in _pooled_conns:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        _pooled_conns.clear()
+
+atexit.register(_close_pooled_conns)
+
+def setup_database():
+    """Inicializa banco de dados com tabelas de auditoria."""
+    try:
+        conn = _connect_db()
+        cursor = conn.cursor()
+        
+        # Tabela de empresas (mantida)
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS empresa (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            cnpj TEXT NOT NULL UNIQUE,
+            nome TEXT NOT NULL,
+            updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+        ''')
+
+        # Tabela de notas fiscais (mantida)
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS nota_fiscal (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chave_acesso TEXT NOT NULL UNIQUE,
+            hash_arquivo TEXT NOT NULL UNIQUE,
+            empresa_id INTEGER NOT NULL,
+            data_processamento TEXT NOT NULL,
+            data_emissao TEXT NOT NULL,
+            tipo_documento TEXT NOT NULL,
+            caminho_arquivo TEXT NOT NULL,
+            status TEXT DEFAULT 'PROCESSADO',
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (empresa_id) REFERENCES empresa (id)
+        )
+        ''')
+        
+        # NOVA: Tabela de auditoria de processamento
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS processing_audit (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            file_hash TEXT NOT NULL,
+            filename TEXT NOT NULL,
+            original_path TEXT NOT NULL,
+            discovered_at TEXT NOT NULL,
+            current_status INTEGER NOT NULL,
+            attempt_count INTEGER DEFAULT 0,
+            last_attempt_at TEXT,
+            last_error_type INTEGER,
+            last_error_message TEXT,
+            final_destination TEXT,
+            chave_acesso TEXT,
+            empresa_id INTEGER,
+            completed_at TEXT,
+            total_duration_ms INTEGER,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+        ''')
+        
+        # NOVA: Tabela de tentativas individuais
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS processing_attempts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            audit_id INTEGER NOT NULL,
+            attempt_number INTEGER NOT NULL,
+            status INTEGER NOT NULL,
+            error_type INTEGER,
+            error_message TEXT,
+            stack_trace TEXT,
+            duration_ms INTEGER,
+            timestamp TEXT DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (audit_id) REFERENCES processing_audit (id)
+        )
+        ''')
+        
+        # NOVA: Tabela de reconciliação
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS reconciliation_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            run_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            files_checked INTEGER,
+            inconsistencies_found INTEGER,
+            issues_fixed INTEGER,
+            details TEXT
+        )
+        ''')
+        
+        # Índices otimizados
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_chave_acesso ON nota_fiscal(chave_acesso)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_hash_arquivo ON nota_fiscal(hash_arquivo)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_empresa_cnpj ON empresa(cnpj)')
+        
+        # Índices para auditoria
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_audit_hash ON processing_audit(file_hash)')
+        # Composto (status, last_attempt_at): atende tanto o GROUP BY de
+        # métricas quanto o range scan da reconciliação sobre registros presos
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_audit_status_attempt
+            ON processing_audit(current_status, last_attempt_at)
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_attempts_audit ON processing_attempts(audit_id)')
+
+        # Índices secundários (suspensos durante ingest em massa)
+        for create_sql in _SECONDARY_INDEXES.values():
+            cursor.execute(create_sql)
+
+        # Índice para os relatórios de métricas (test_confiabilidade): o
+        # índice parcial exclui as linhas sem duração
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_audit_status_duration
+            ON processing_audit(current_status, total_duration_ms)
+            WHERE total_duration_ms IS NOT NULL
+        ''')
+        # ORDER BY id DESC já é um scan reverso do rowid: índice sobre a PK
+        # só custava um B-tree extra por insert (removido de bases antigas)
+        cursor.execute('DROP INDEX IF EXISTS idx_recon_id_desc')
+        
+        conn.commit()
+        conn.close()
+        logger.info("✓ Banco de dados inicializado com sistema de auditoria")
+    except Exception as e:
+        logger.critical(f"✗ Falha ao inicializar banco: {e}")
+        raise
+
+# Índices secundários de consulta/relatório: nenhum participa da dedup nem do
+# caminho de escrita, então podem ser suspensos durante um ingest em massa —
+# manter B-trees atualizadas a cada INSERT custa page splits; reconstruir uma
+# vez ao final é sequencial e muito mais barato.
+_SECONDARY_INDEXES = {
+    'idx_empresa_id': 'CREATE INDEX IF NOT EXISTS idx_empresa_id ON nota_fiscal(empresa_id)',
+    'idx_data_emissao': 'CREATE INDEX IF NOT EXISTS idx_data_emissao ON nota_fiscal(data_emissao)',
+    'idx_audit_chave': 'CREATE INDEX IF NOT EXISTS idx_audit_chave ON processing_audit(chave_acesso)',
+}
+
+def begin_bulk_mode():
+    """Derruba os índices secundários antes de um lote grande de inserções."""
+    try:
+        conn = _connect_db()
+        for name in _SECONDARY_INDEXES:
+            conn.execute(f'DROP INDEX IF EXISTS {name}')
+        conn.commit()
+        conn.close()
+        logger.info("→ Modo bulk: índices secundários suspensos")
+    except Exception as e:
+        logger.warning(f"Falha ao entrar em modo bulk (seguindo com índices): {e}")
+
+def end_bulk_mode():
+    """Recria os índices secundários após o ingest (um build sequencial cada)."""
+    try:
+        conn = _connect_db()
+        for create_sql in _SECONDARY_INDEXES.values():
+            conn.execute(create_sql)
+        conn.commit()
+        conn.close()
+        logger.info("✓ Modo bulk encerrado: índices secundários recriados")
+    except Exception as e:
+        logger.error(f"Falha ao recriar índices secundários: {e}")
+
+def migrate_old_database():
+    """Migra dados do banco antigo se existir."""
+    try:
+        conn = _connect_db()
+        cursor = conn.cursor()
+        
+        # Verifica se há dados antigos para migrar
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
+        tables = [row[0] for row in cursor.fetchall()]
+        
+        if 'empresa' in tables and 'processing_audit' not in tables:
+            logger.info("→ Banco antigo detectado, criando tabelas de auditoria...")
+            setup_database()
+
+        # Migração única dos statuses legados gravados como TEXT
+        # ('PROCESSING', 'SUCCESS', ...) para os inteiros das enums: sem ela,
+        # registros anteriores ao upgrade nunca casariam com os IN(...) da
+        # reconciliação nem com as métricas por status. typeof() limita o
+        # UPDATE às linhas antigas — em bancos já migrados não toca nada.
+        status_case = ' '.join(
+            f"WHEN '{s.name}' THEN {s.value}" for s in ProcessingStatus
+        )
+        error_case = ' '.join(
+            f"WHEN '{e.name}' THEN {e.value}" for e in ErrorType
+        )
+        migrated = 0
+        if 'processing_audit' in tables:
+            cursor.execute(f'''
+                UPDATE processing_audit
+                SET current_status = CASE current_status {status_case}
+                                     ELSE current_status END
+                WHERE typeof(current_status) = 'text'
+            ''')
+            migrated += cursor.rowcount
+            cursor.execute(f'''
+                UPDATE processing_audit
+                SET last_error_type = CASE last_error_type {error_case}
+                                      ELSE last_error_type END
+                WHERE typeof(last_error_type) = 'text'
+            ''')
+            migrated += cursor.rowcount
+        if 'processing_attempts' in tables:
+            cursor.execute(f'''
+                UPDATE processing_attempts
+                SET status = CASE status {status_case} ELSE status END
+                WHERE typeof(status) = 'text'
+            ''')
+            migrated += cursor.rowcount
+            cursor.execute(f'''
+                UPDATE processing_attempts
+                SET error_type = CASE error_type {error_case} ELSE error_type END
+                WHERE typeof(error_type) = 'text'
+            ''')
+            migrated += cursor.rowcount
+        if migrated:
+            conn.commit()
+            logger.info(f"✓ Migração: {migrated} coluna(s) de status TEXT convertidas para inteiro")
+
+        conn.close()
+    except Exception as e:
+        logger.warning(f"Aviso na migração: {e}")
+
+# ============================================================================
+# FUNÇÕES DE AUDITORIA
+# ============================================================================
+
+class AuditWriter:
+    """
+    Thread escritora única para as escritas de auditoria.
+
+    Em vez de cada worker abrir conexão e disputar o db_lock, os workers
+    apenas enfileiram (sql, params); uma única thread, dona de uma conexão
+    persistente, drena a fila em lotes (até MAX_BATCH itens ou FLUSH_INTERVAL,
+    o que vier primeiro), agrupa por SQL e grava tudo via executemany em uma
+    transação (BEGIN IMMEDIATE ... COMMIT). O custo do BEGIN/COMMIT é
+    amortizado sobre o lote inteiro e os workers nunca bloqueiam em disco.
+
+    Isso também elimina o commit-por-chamada do trilho de auditoria: as
+    ~6-8 escritas que um arquivo gera (status intermediários + tentativas)
+    saem em um único fsync, junto com as dos demais arquivos do lote — mais
+    agressivo que agrupar por arquivo, sem transação aberta durante I/O.
+    """
+
+    MAX_BATCH = 500
+    FLUSH_INTERVAL = 0.1  # segundos
+    CHECKPOINT_EVERY = 100  # commits entre checkpoints PASSIVE do WAL
+
+    _CLOSE = object()  # sentinela de encerramento
+
+    def __init__(self):
+        self._queue: "queue.Queue" = queue.Queue()
+        self._start_lock = Lock()
+        self._thread = None
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._start_lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = Thread(target=self._run, name='audit-writer', daemon=True)
+                    self._thread.start()
+
+    def enqueue(self, sql: str, params: tuple):
+        """Enfileira um statement de auditoria (não bloqueia em disco)."""
+        self._ensure_thread()
+        self._queue.put((sql, params))
+
+    def flush(self):
+        """Bloqueia até tudo que já foi enfileirado estar gravado."""
+        if self._thread is None or not self._thread.is_alive():
+            return
+        done = Event()
+        self._queue.put(done)
+        done.wait(timeout=30)
+
+    def close(self):
+        """Drena a fila e encerra a thread escritora."""
+        if self._thread is None or not self._thread.is_alive():
+            return
+        self.flush()
+        self._queue.put(self._CLOSE)
+        self._thread.join(timeout=10)
+
+    def _run(self):
+        conn = _connect_db()
+        commits = 0
+        try:
+            while True:
+                item = self._queue.get()
+                if item is self._CLOSE:
+                    break
+
+                batch = []
+                events = []
+                deadline = time.time() + self.FLUSH_INTERVAL
+                while item is not None:
+                    # O sentinela pode chegar pelo get interno durante o
+                    # drain: nunca entra no batch (não é um par (sql, params))
+                    if item is self._CLOSE:
+                        break
+                    if isinstance(item, Event):
+                        events.append(item)
+                    else:
+                        batch.append(item)
+                    if len(batch) >= self.MAX_BATCH:
+                        break
+                    try:
+                        item = self._queue.get(timeout=max(0.0, deadline - time.time()))
+                    except queue.Empty:
+                        item = None
+
+                if batch:
+                    self._write_batch(conn, batch)
+                    commits += 1
+                    # Checkpoint PASSIVE fora do caminho de escrita dos
+                    # workers: não bloqueia e evita crescimento do WAL
+                    if commits % self.CHECKPOINT_EVERY == 0:
+                        try:
+                            conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+                        except Exception as e:
+                            logger.debug(f"wal_checkpoint(PASSIVE) falhou: {e}")
+                for done in events:
+                    done.set()
+                if item is self._CLOSE:
+                    break
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _write_batch(conn: sqlite3.Connection, batch: list):
+        # Agrupa por SQL para reaproveitar o statement preparado no executemany
+        grouped: Dict[str, list] = {}
+        for sql, params in batch:
+            grouped.setdefault(sql, []).append(params)
+
+        try:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            for sql, rows in grouped.items():
+                cursor.executemany(sql, rows)
+            conn.commit()
+        except Exception as e:
+            logger.error(f"Erro ao gravar lote de auditoria: {e}")
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+
+audit_writer = AuditWriter()
+
+def _json_dumps(obj) -> str:
+    """Serializa para JSON usando orjson (C) quando instalado."""
+    if orjson is not None:
+        return orjson.dumps(obj).decode('utf-8')
+    return json.dumps(obj, ensure_ascii=False)
+
+def audit_log(event: str, details: dict):
+    """Registra evento de auditoria (nunca falha)."""
+    try:
+        audit_logger.info(_json_dumps({
+            'event': event,
+            'timestamp': datetime.now().isoformat(),
+            **details
+        }))
+    except Exception as e:
+        logger.error(f"Erro ao registrar auditoria: {e}")
+
+# Sinaliza escrita de auditoria desde a última reconciliação limpa: quando os
+# diretórios estão vazios e nada mudou no banco, o ciclo de reconciliação pode
+# ser pulado por inteiro. Começa True para forçar a primeira rodada completa.
+_needs_reconcile = True
+
+def create_processing_record(file_path: Path, file_hash: str) -> int:
+    """Cria registro inicial de processamento e retorna audit_id."""
+    global _needs_reconcile
+    _needs_reconcile = True
+    try:
+        with db_lock:
+            conn = get_conn()
+            cursor = conn.cursor()
+            
+            cursor.execute(SQL_INSERT_AUDIT, (
+                file_hash,
+                file_path.name,
+                str(file_path),
+                datetime.now().isoformat(),
+                ProcessingStatus.PENDING.value
+            ))
+            
+            audit_id = cursor.lastrowid
+            conn.commit()
+            
+            audit_log('FILE_DISCOVERED', {
+                'audit_id': audit_id,
+                'filename': file_path.name,
+                'hash': file_hash
+            })
+            
+            return audit_id
+            
+    except Exception as e:
+        logger.error(f"Erro ao criar registro de processamento: {e}")
+        return None
+
+def update_processing_status(audit_id: int, status: ProcessingStatus, 
+                            error_type: Optional[ErrorType] = None,
+                            error_message: Optional[str] = None,
+                            **kwargs):
+    """Atualiza status de processamento (gravado em lote via audit_writer)."""
+    global _needs_reconcile
+    _needs_reconcile = True
+    try:
+        audit_writer.enqueue(SQL_UPDATE_STATUS, (
+            status.value,
+            error_type.value if error_type is not None else None,
+            error_message[:500] if error_message else None,  # Limita tamanho
+            kwargs.get('chave_acesso'),
+            kwargs.get('empresa_id'),
+            kwargs.get('final_destination'),
+            kwargs.get('completed_at'),
+            kwargs.get('total_duration_ms'),
+            audit_id
+        ))
+
+    except Exception as e:
+        logger.error(f"Erro ao atualizar status: {e}")
+
+def record_attempt(audit_id: int, attempt_number: int, status: ProcessingStatus,
+                  error_type: Optional[ErrorType] = None,
+                  error_message: Optional[str] = None,
+                  stack_trace: Optional[str] = None,
+                  duration_ms: Optional[int] = None):
+    """Registra tentativa individual de processamento (gravada em lote)."""
+    try:
+        audit_writer.enqueue(SQL_INSERT_ATTEMPT, (
+            audit_id,
+            attempt_number,
+            status.value,
+            error_type.value if error_type is not None else None,
+            error_message[:500] if error_message else None,
+            stack_trace[:2000] if stack_trace else None,
+            duration_ms
+        ))
+
+        # Atualiza contador de tentativas
+        audit_writer.enqueue(SQL_BUMP_ATTEMPTS, (audit_id,))
+
+        audit_log('PROCESSING_ATTEMPT', {
+            'audit_id': audit_id,
+            'attempt': attempt_number,
+            'status': status.name,
+            'error': error_type.name if error_type is not None else None
+        })
+
+    except Exception as e:
+        logger.error(f"Erro ao registrar tentativa: {e}")
+
+# ============================================================================
+# FUNÇÕES AUXILIARES (mantidas do original)
+# ============================================================================
+
+# Buffer de leitura reutilizado por thread no fallback de hash: cada worker
+# aloca seu bloco de 1 MiB uma única vez e o readinto preenche sempre o mesmo
+# buffer — nenhum objeto bytes novo por chunk lido.
+_read_tls = local()
+
+def _thread_read_buffer() -> bytearray:
+    buf = getattr(_read_tls, 'buf', None)
+    if buf is None:
+        buf = bytearray(1048576)
+        _read_tls.buf = buf
+    return buf
+
+def calculate_file_hash(file_path: Path) -> Optional[str]:
+    """
+    Calcula hash MD5 do arquivo.
+
+    MD5 é mantido como algoritmo porque hash_arquivo é a chave de dedup de
+    todo o histórico já gravado — trocar o algoritmo invalidaria esses keys.
+    O custo do loop em Python é eliminado com hashlib.file_digest (3.11+),
+    que lê e alimenta o hasher inteiramente em C; o fallback lê via readinto
+    no buffer por-thread para não alocar um chunk novo a cada iteração.
+    """
+    try:
+        with open(file_path, "rb") as f:
+            if hasattr(hashlib, 'file_digest'):
+                return hashlib.file_digest(f, hashlib.md5).hexdigest()
+            hash_md5 = hashlib.md5()
+            buf = _thread_read_buffer()
+            view = memoryview(buf)
+            while True:
+                n = f.readinto(buf)
+                if not n:
+                    break
+                hash_md5.update(view[:n])
+            return hash_md5.hexdigest()
+    except Exception as e:
+        logger.error(f"Erro ao calcular hash de {file_path.name}: {e}")
+        return None
+
+# Tabela e regex montados no import — este caminho roda uma vez por XML.
+# str.translate remove a pontuação num scan em C, mais barato que regex para
+# uma classe fixa de caracteres; o colapso de espaços continua no re compilado.
+_PUNCT_TABLE = str.maketrans('', '', '.-/\\')
+_RE_WS = re.compile(r'\s+')
+
+@lru_cache(maxsize=8192)
+def standardize_company_name(name: str) -> str:
+    """Padroniza nome da empresa (memoizado: os emitentes se repetem muito)."""
+    name = name.translate(_PUNCT_TABLE)
+    return _RE_WS.sub(' ', name).strip().upper()
+
+def get_or_create_company(cnpj: str, nome_xml: str) -> int:
+    """Obtém ou cria empresa no banco (UPSERT em um único round-trip)."""
+    nome_padronizado = standardize_company_name(nome_xml)
+
+    with cache_lock:
+        cached = company_cache.get(cnpj)
+        if cached is not None and cached["nome"] == nome_padronizado:
+            return cached["id"]
+
+        with db_lock:
+            conn = get_conn()
+            cursor = conn.cursor()
+            cursor.execute(SQL_UPSERT_EMPRESA, (cnpj, nome_padronizado))
+            conn.commit()
+
+            if cached is not None:
+                company_id = cached["id"]
+            else:
+                cursor.execute("SELECT id FROM empresa WHERE cnpj = ?", (cnpj,))
+                company_id = cursor.fetchone()[0]
+
+            company_cache[cnpj] = {"id": company_id, "nome": nome_padronizado}
+            return company_id
+
+# Namespace NF-e e tags pré-qualificadas: montar '{uri}tag' uma única vez no
+# import evita reconstruir dicts de namespace e strings por arquivo parseado.
+NFE_NS = 'http://www.portalfiscal.inf.br/nfe'
+
+def _q(tag: str) -> str:
+    """Nome totalmente qualificado de uma tag no namespace NF-e."""
+    return f'{{{NFE_NS}}}{tag}'
+
+Q_INFNFE = _q('infNFe')
+Q_IDE = _q('ide')
+Q_EMIT = _q('emit')
+Q_DHEMI = _q('dhEmi')
+Q_DEMI = _q('dEmi')
+Q_MOD = _q('mod')
+Q_CNPJ = _q('CNPJ')
+Q_XNOME = _q('xNome')
+
+# O layout da NF-e v4.00 é fixo, então o extrator é especializado para ele:
+# a tabela tag → campo é montada uma vez no import e o loop de streaming vira
+# um único lookup de dict por elemento, em vez de uma escada de if/elif.
+_STREAM_FIELDS = {
+    Q_DHEMI: 'data_emissao',
+    Q_DEMI: 'data_emissao',
+    Q_MOD: 'modelo',
+    Q_CNPJ: 'cnpj',
+    Q_XNOME: 'nome_empresa',
+}
+_STREAM_TAGS = (Q_INFNFE, Q_DHEMI, Q_DEMI, Q_MOD, Q_CNPJ, Q_XNOME, Q_EMIT)
+_N_STREAM_FIELDS = 4  # data_emissao, modelo, cnpj, nome_empresa
+
+# Variante com as tags sem namespace, para o streaming via ET.iterparse
+# (que, sem filtro de tag, também enxerga documentos fora do namespace NF-e)
+_STREAM_FIELDS_ANYNS = dict(_STREAM_FIELDS)
+_STREAM_FIELDS_ANYNS.update({
+    'dhEmi': 'data_emissao',
+    'dEmi': 'data_emissao',
+    'mod': 'modelo',
+    'CNPJ': 'cnpj',
+    'xNome': 'nome_empresa',
+})
+
+# Caminhos de busca pré-montados para o fallback ElementTree
+_P_INFNFE_Q = f'.//{Q_INFNFE}'
+_P_INFNFE = './/infNFe'
+_DATE_TAGS = ((Q_DHEMI, 'dhEmi'), (Q_DEMI, 'dEmi'))
+
+def _find_child(parent, qualified: str, bare: str):
+    """Busca filho pela tag qualificada, com fallback para XML sem namespace."""
+    elem = parent.find(qualified)
+    if elem is None:
+        elem = parent.find(bare)
+    return elem
+
+# Cache do dia corrente: datetime.now().strftime por arquivo vira um lookup;
+# o tm_yday na chave invalida o cache na virada do dia
+_today_cached = None
+
+def _today_str() -> str:
+    global _today_cached
+    now = time.localtime()
+    key = (now.tm_year, now.tm_yday)
+    cached = _today_cached
+    if cached is None or cached[0] != key:
+        cached = (key, time.strftime('%Y-%m-%d', now))
+        _today_cached = cached
+    return cached[1]
+
+@lru_cache(maxsize=4096)
+def _parse_emission_date(data_emissao_str: str) -> Tuple[str, str, str, str]:
+    """
+    Converte a data de emissão em (YYYY-MM-DD, YYYY, MM-YYYY, DD).
+
+    strptime é uma máquina de estados em Python puro e as datas se repetem
+    muito dentro de um lote (arquivos do mesmo dia), então o resultado é
+    memoizado — repetição vira um lookup de dict.
+    """
+    dt = datetime.strptime(data_emissao_str, '%Y-%m-%d')
+    return (dt.strftime('%Y-%m-%d'), dt.strftime('%Y'),
+            dt.strftime('%m-%Y'), dt.strftime('%d'))
+
+def _build_info(chave_acesso: str, data_emissao_str: str, modelo: Optional[str],
+                cnpj: Optional[str], nome_empresa: Optional[str]) -> Optional[dict]:
+    """Monta o dict de informações da NF-e a partir dos campos extraídos."""
+    if not data_emissao_str or not cnpj or not nome_empresa:
+        return None
+
+    data_emissao, ano, mes_ano, dia = _parse_emission_date(data_emissao_str)
+    tipo_documento = 'NFE' if modelo == '55' else 'NFCE' if modelo == '65' else f"MOD{modelo}"
+
+    return {
+        "data_processamento": _today_str(),
+        "data_emissao": data_emissao,
+        "chave_acesso": chave_acesso,
+        "empresa_nome_xml": nome_empresa,
+        "empresa_nome_padronizado": standardize_company_name(nome_empresa),
+        "cnpj": cnpj,
+        "tipo_documento": tipo_documento,
+        "ano_emissao": ano,
+        "mes_ano_emissao": mes_ano,
+        "dia_emissao": dia
+    }
+
+def _get_xml_info_stream(source) -> Optional[dict]:
+    """
+    Extração via lxml.iterparse: lê o documento em streaming e interrompe
+    assim que os campos do cabeçalho (ide/emit) foram capturados — NF-e com
+    centenas de itens <det> nem chegam a ser parseadas por inteiro.
+
+    `source` pode ser um caminho (str) ou um file-object binário.
+    """
+    chave_acesso = ''
+    fields = {}
+    field_of = _STREAM_FIELDS  # lookup local: evita acesso a global no loop
+
+    context = lxml_etree.iterparse(
+        source,
+        events=('start', 'end'),
+        tag=_STREAM_TAGS
+    )
+    try:
+        for event, elem in context:
+            if event == 'start':
+                if elem.tag == Q_INFNFE:
+                    chave_acesso = (elem.get('Id') or '').replace('NFe', '').replace('nfe', '')
+                continue
+
+            key = field_of.get(elem.tag)
+            if key is not None:
+                fields[key] = elem.text
+                if len(fields) == _N_STREAM_FIELDS:
+                    break
+            elif elem.tag == Q_EMIT:
+                # emit fecha depois de CNPJ/xNome: tudo que precisamos já passou
+                break
+
+            # Libera os elementos já consumidos para manter a memória estável
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+    finally:
+        del context
+
+    data_emissao_str = fields.get('data_emissao') or ''
+    if 'T' in data_emissao_str:
+        data_emissao_str = data_emissao_str.split('T')[0]
+
+    return _build_info(chave_acesso, data_emissao_str, fields.get('modelo'),
+                       fields.get('cnpj'), fields.get('nome_empresa'))
+
+def _get_xml_info_stream_et(source) -> Optional[dict]:
+    """
+    Versão ElementTree do streaming: sem lxml, o fallback era ET.parse, que
+    monta o DOM do documento inteiro só para ler meia dúzia de campos do
+    cabeçalho. ET.iterparse não tem filtro de tag, mas o early-exit no
+    fechamento de <emit> dá o mesmo O(bytes do cabeçalho). A tabela inclui
+    as tags sem namespace, que aqui não passam por filtro nenhum.
+    """
+    chave_acesso = ''
+    fields = {}
+    field_of = _STREAM_FIELDS_ANYNS
+
+    for event, elem in ET.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            if elem.tag == Q_INFNFE or elem.tag == 'infNFe':
+                chave_acesso = (elem.get('Id') or '').replace('NFe', '').replace('nfe', '')
+            continue
+
+        key = field_of.get(elem.tag)
+        if key is not None:
+            fields[key] = elem.text
+            if len(fields) == _N_STREAM_FIELDS:
+                break
+        elif elem.tag == Q_EMIT or elem.tag == 'emit':
+            # emit fecha depois de CNPJ/xNome: tudo que precisamos já passou
+            break
+        elem.clear()
+
+    data_emissao_str = fields.get('data_emissao') or ''
+    if 'T' in data_emissao_str:
+        data_emissao_str = data_emissao_str.split('T')[0]
+
+    return _build_info(chave_acesso, data_emissao_str, fields.get('modelo'),
+                       fields.get('cnpj'), fields.get('nome_empresa'))
+
+def get_xml_info(xml_file: Path) -> Optional[dict]:
+    """Extrai informações do XML (mantida lógica original)."""
+    return _extract_info(str(xml_file), xml_file.name)
+
+def parse_nfe_bytes(data: bytes, name: str) -> Optional[dict]:
+    """Função pura (picklável) usada pelo pool de processos de parse."""
+    return get_xml_info_from_bytes(data, name)
+
+# Pool de processos para o estágio CPU-bound (parse do XML): as threads do
+# ThreadPoolExecutor serializam no GIL durante o parse; processos usam todos
+# os núcleos. O main() cria o pool ANTES de subir os pools de threads: fork
+# com dezenas de threads vivas pode clonar locks (logging, db_lock) presos e
+# travar o filho. O lazy init fica só como fallback para uso fora do main().
+_parse_pool: Optional[ProcessPoolExecutor] = None
+_parse_pool_lock = Lock()
+
+def _get_parse_pool() -> ProcessPoolExecutor:
+    global _parse_pool
+    if _parse_pool is None:
+        with _parse_pool_lock:
+            if _parse_pool is None:
+                _parse_pool = ProcessPoolExecutor(max_workers=os.cpu_count())
+    return _parse_pool
+
+def _parse_in_pool(data: bytes, name: str) -> Optional[dict]:
+    """Parse no pool de processos, com fallback inline se o pool falhar."""
+    try:
+        return _get_parse_pool().submit(parse_nfe_bytes, data, name).result()
+    except Exception as e:
+        logger.warning(f"Pool de parse indisponível ({e}), parseando inline")
+        return get_xml_info_from_bytes(data, name)
+
+def get_xml_info_from_bytes(data: bytes, name: str) -> Optional[dict]:
+    """
+    Extrai informações da NF-e a partir de um buffer já lido. Evita reabrir o
+    arquivo quando o conteúdo já está em memória (hash + parse em uma leitura).
+    """
+    return _extract_info(io.BytesIO(data), name)
+
+def _extract_info(source, name: str) -> Optional[dict]:
+    """
+    Extração compartilhada: streaming com early-exit (lxml quando disponível,
+    senão ET.iterparse); o DOM completo via ET.parse fica como último recurso
+    para documentos fora do formato esperado.
+    """
+    try:
+        if lxml_etree is not None:
+            info = _get_xml_info_stream(source)
+        else:
+            info = _get_xml_info_stream_et(source)
+        if info is not None:
+            return info
+        # Campos do cabeçalho ausentes: tenta o parse completo abaixo
+    except Exception as e:
+        logger.debug(f"Streaming parse falhou para {name}, usando ET: {e}")
+    if hasattr(source, 'seek'):
+        source.seek(0)
+
+    try:
+        tree = ET.parse(source)
+        root = tree.getroot()
+
+        infNFe = root.find(_P_INFNFE_Q)
+        if infNFe is None:
+            infNFe = root.find(_P_INFNFE)
+
+        if infNFe is None:
+            for elem in root.iter():
+                if elem.tag.endswith('infNFe'):
+                    infNFe = elem
+                    break
+
+        if infNFe is None:
+            return None
+
+        chave_acesso = infNFe.get('Id', '').replace('NFe', '').replace('nfe', '')
+
+        ide = _find_child(infNFe, Q_IDE, 'ide')
+        emit = _find_child(infNFe, Q_EMIT, 'emit')
+
+        if ide is None or emit is None:
+            return None
+
+        data_emissao_str = None
+        for qualified, bare in _DATE_TAGS:
+            elem = _find_child(ide, qualified, bare)
+            if elem is not None:
+                data_emissao_str = elem.text.split('T')[0] if 'T' in elem.text else elem.text
+                break
+
+        mod_elem = _find_child(ide, Q_MOD, 'mod')
+        modelo = mod_elem.text if mod_elem is not None else None
+
+        cnpj_elem = _find_child(emit, Q_CNPJ, 'CNPJ')
+        nome_elem = _find_child(emit, Q_XNOME, 'xNome')
+        cnpj = cnpj_elem.text if cnpj_elem is not None else None
+        nome_empresa = nome_elem.text if nome_elem is not None else None
+
+        return _build_info(chave_acesso, data_emissao_str, modelo, cnpj, nome_empresa)
+
+    except Exception as e:
+        logger.error(f"Erro ao parsear XML {name}: {e}")
+        return None
+
+class _BloomFilter:
+    """
+    Filtro de Bloom mínimo (stdlib) usado como cache negativo de dedup.
+
+    Guardar os hashes/chaves como strings em sets custava centenas de bytes
+    por nota; aqui são ~10 bits por elemento. Falso-positivo só provoca uma
+    consulta ao banco (que dá a resposta certa); falso-negativo não existe,
+    então o filtro nunca deixa passar duplicata.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 1e-5):
+        ln2 = math.log(2)
+        self.num_bits = max(64, int(-capacity * math.log(error_rate) / (ln2 * ln2)))
+        self.num_hashes = max(1, round(self.num_bits / capacity * ln2))
+        self._bits = bytearray((self.num_bits + 7) // 8)
+
+    def _positions(self, value: str):
+        # Dupla hashing: h1 + i*h2 gera k posições a partir de um digest só
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, value: str):
+        bits = self._bits
+        for pos in self._positions(value):
+            bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, value: str) -> bool:
+        bits = self._bits
+        return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(value))
+
+# Filtros por coluna de dedup, populados em load_caches
+_dedup_blooms: Dict[str, _BloomFilter] = {}
+_bloom_lock = Lock()
+
+def _dedup_remember(file_hash: str, chave_acesso: str):
+    """Registra uma nota recém-inserida nos filtros de dedup."""
+    with _bloom_lock:
+        bloom = _dedup_blooms.get('hash_arquivo')
+        if bloom is not None:
+            bloom.add(file_hash)
+        bloom = _dedup_blooms.get('chave_acesso')
+        if bloom is not None:
+            bloom.add(chave_acesso)
+
+def load_caches():
+    """Carrega cache de empresas e os filtros de Bloom da dedup de notas."""
+    global company_cache
+
+    try:
+        conn = _connect_db()
+        cursor = conn.cursor()
+
+        # Iterar o cursor direto evita materializar a lista intermediária do
+        # fetchall; a comprehension monta o dict inteiro em C
+        company_cache = {
+            cnpj: {"id": empresa_id, "nome": nome}
+            for cnpj, empresa_id, nome in conn.execute("SELECT cnpj, id, nome FROM empresa")
+        }
+
+        # Capacidade com folga de 2x para a operação contínua; se estourar,
+        # o FPR degrada mas a resposta continua correta (confirmada no banco)
+        cursor.execute("SELECT COUNT(*) FROM nota_fiscal")
+        total_notas = cursor.fetchone()[0]
+        capacity = max(100_000, total_notas * 2)
+
+        bloom_hash = _BloomFilter(capacity)
+        bloom_chave = _BloomFilter(capacity)
+        cursor.execute("SELECT hash_arquivo, chave_acesso FROM nota_fiscal")
+        for file_hash, chave_acesso in cursor:
+            bloom_hash.add(file_hash)
+            bloom_chave.add(chave_acesso)
+
+        with _bloom_lock:
+            _dedup_blooms['hash_arquivo'] = bloom_hash
+            _dedup_blooms['chave_acesso'] = bloom_chave
+
+        conn.close()
+        logger.info(f"✓ Cache: {len(company_cache)} empresas | {total_notas} notas nos filtros de dedup")
+    except Exception as e:
+        logger.error(f"Erro ao carregar cache: {e}")
+
+def _nota_exists(column: str, value: str) -> bool:
+    """
+    Consulta de dedup: filtro de Bloom primeiro, banco só na dúvida.
+
+    O caso comum (arquivo inédito) resolve no filtro em memória sem tocar o
+    SQLite; um positivo — real ou falso — é confirmado no índice UNIQUE de
+    hash_arquivo/chave_acesso, que dá a resposta exata em O(log N).
+    """
+    try:
+        bloom = _dedup_blooms.get(column)
+        if bloom is not None and value not in bloom:
+            return False
+
+        cursor = get_conn().cursor()
+        cursor.execute(f"SELECT 1 FROM nota_fiscal WHERE {column} = ? LIMIT 1", (value,))
+        return cursor.fetchone() is not None
+    except Exception as e:
+        logger.error(f"Erro na consulta de dedup ({column}): {e}")
+        return False
+
+# ============================================================================
+# PROCESSAMENTO COM RETRY E TRANSAÇÃO ATÔMICA
+# ============================================================================
+
+# Diretórios de destino já criados: mkdir(parents=True) custa um stat por
+# nível de caminho a cada arquivo, e os destinos se repetem (empresa/ano/mês).
+_created_dirs = set()
+_created_dirs_lock = Lock()
+
+def _ensure_dir(path: Path):
+    """Cria o diretório uma única vez por processo; depois vira lookup em set."""
+    key = str(path)
+    if key in _created_dirs:
+        return
+    path.mkdir(parents=True, exist_ok=True)
+    with _created_dirs_lock:
+        _created_dirs.add(key)
+
+def _fast_move(src: Path, dst: Path):
+    """
+    Move arquivo preferindo os.replace (rename atômico, um syscall) quando
+    origem e destino estão no mesmo filesystem — caso de todas as transições
+    dentro de xml_organizer_data. Em cross-device (EXDEV, ex.: envio para o
+    drive de rede) cai no shutil.move, que copia e remove.
+    """
+    try:
+        os.replace(src, dst)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        shutil.move(str(src), str(dst))
+
+def move_to_quarantine(source: Path) -> Optional[Path]:
+    """
+    Move arquivo para quarentena ANTES de processar.
+    CRÍTICO: Garante que arquivo não seja perdido se algo der errado.
+    """
+    try:
+        # Nome único com timestamp para evitar conflitos
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+        quarantine_file = QUARANTINE_DIRECTORY / f"{timestamp}_{source.name}"
+        
+        _fast_move(source, quarantine_file)
+        audit_log('FILE_QUARANTINED', {
+            'original': str(source),
+            'quarantine': str(quarantine_file)
+        })
+        return quarantine_file
+        
+    except Exception as e:
+        logger.error(f"CRÍTICO: Falha ao mover para quarentena {source.name}: {e}")
+        audit_log('QUARANTINE_FAILED', {
+            'file': str(source),
+            'error': str(e)
+        })
+        return None
+
+def atomic_process_file(quarantine_file: Path, audit_id: int, attempt_number: int,
+                        file_hash: Optional[str] = None) -> Tuple[bool, Optional[str], Optional[ErrorType]]:
+    """
+    Processa arquivo de forma atômica com rollback em caso de falha.
+
+    `file_hash` vem do chamador quando o arquivo já foi hasheado na descoberta
+    (o conteúdo não muda entre source e quarentena) — evita reler o arquivo.
+    
+    Returns:
+        (success, error_message, error_type)
+    """
+    start_time = time.time()
+    conn = None
+    empresa_id = None
+    chave_acesso = None
+    destination_path = None
+    
+    try:
+        # FASE 1: Ler o arquivo uma única vez; hash e parse compartilham o
+        # buffer. Arquivos acima de LARGE_FILE_THRESHOLD (raros) voltam para
+        # hash/parse em streaming para não inflar o RSS.
+        try:
+            if quarantine_file.stat().st_size >= LARGE_FILE_THRESHOLD:
+                data = None
+                if not file_hash:
+                    file_hash = calculate_file_hash(quarantine_file)
+                if not file_hash:
+                    return False, "Falha ao calcular hash", ErrorType.FILE_NOT_FOUND
+            else:
+                data = quarantine_file.read_bytes()
+                if not file_hash:
+                    # MD5 mantido como chave de dedup (compatível com hash_arquivo)
+                    file_hash = hashlib.md5(data).hexdigest()
+        except OSError as e:
+            logger.error(f"Erro ao ler {quarantine_file.name}: {e}")
+            return False, "Falha ao ler arquivo", ErrorType.FILE_NOT_FOUND
+
+        # Verificar duplicata por hash
+        if _nota_exists('hash_arquivo', file_hash):
+            update_processing_status(audit_id, ProcessingStatus.DUPLICATE)
+            quarantine_file.unlink()
+            return True, "Duplicado (hash)", None  # Sucesso (arquivo já processado)
+
+        # FASE 2: Parsear XML a partir do mesmo buffer (CPU vai para o pool
+        # de processos; esta thread segue livre para I/O e banco)
+        if data is not None:
+            info = _parse_in_pool(data, quarantine_file.name)
+        else:
+            info = get_xml_info(quarantine_file)  # streaming direto do disco
+        if not info:
+            return False, "XML inválido ou incompleto", ErrorType.XML_INVALID_STRUCTURE
+        
+        chave_acesso = info["chave_acesso"]
+
+        # Duplicata por chave é detectada pelo próprio INSERT (ON CONFLICT
+        # DO NOTHING) na FASE 5 — sem pré-checagem nem janela de corrida
+        update_processing_status(audit_id, ProcessingStatus.PARSED, chave_acesso=chave_acesso)
+        
+        # FASE 3: Obter/criar empresa
+        empresa_id = get_or_create_company(info["cnpj"], info["empresa_nome_xml"])
+        nome_empresa_final = company_cache[info["cnpj"]]["nome"]
+        info["empresa_nome_padronizado"] = nome_empresa_final
+        
+        # FASE 4: Preparar destino
+        destination_path = (
+            DESTINATION_NETWORK_DIRECTORY /
+            f"{nome_empresa_final} - {info['cnpj']}" /
+            info['tipo_documento'] /
+            info['ano_emissao'] /
+            info['mes_ano_emissao'] /
+            info['dia_emissao'] /
+            quarantine_file.name
+        )
+        
+        # Sem stat() preventivo no destino: duplicata real é barrada pelos
+        # UNIQUE de chave_acesso/hash_arquivo no INSERT abaixo, e o
+        # os.replace é atômico — um stat no drive de rede custa milissegundos
+        # por arquivo e não cobria nenhum caso que o banco já não cubra
+
+        # FASE 5: Preparar o diretório de destino ANTES de qualquer transação:
+        # são até seis níveis de mkdir no drive de rede, e isso não pode
+        # acontecer com o write lock do SQLite em mãos — todos os outros
+        # escritores serializariam atrás deste I/O.
+        try:
+            _ensure_dir(destination_path.parent)
+        except OSError as e:
+            return False, f"Erro ao criar diretório destino: {e}", ErrorType.FILE_PERMISSION_ERROR
+
+        # FASE 6: INSERT em transação curta, confirmado ANTES do move — o
+        # lock de escrita dura só o INSERT, nunca a cópia para o drive de
+        # rede (um move lento estouraria o busy_timeout dos demais workers).
+        # Falha no move desfaz com um DELETE compensatório e o arquivo volta
+        # ao fluxo de retry pela quarentena.
+        conn = get_conn()
+        cursor = conn.cursor()
+
+        try:
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute(SQL_INSERT_NOTA, (
+                chave_acesso,
+                file_hash,
+                empresa_id,
+                info["data_processamento"],
+                info["data_emissao"],
+                info["tipo_documento"],
+                str(destination_path)
+            ))
+
+            if cursor.rowcount == 0:
+                # Conflito em chave_acesso ou hash_arquivo: nota já registrada
+                conn.rollback()
+                update_processing_status(audit_id, ProcessingStatus.DUPLICATE,
+                                        chave_acesso=chave_acesso)
+                quarantine_file.unlink()
+                return True, "Duplicado (BD)", None
+
+            nota_id = cursor.lastrowid
+            conn.commit()
+
+        except Exception as e:
+            conn.rollback()
+            return False, f"Erro BD: {e}", ErrorType.DB_CONNECTION_ERROR
+
+        # Mover arquivo físico, já fora de qualquer transação
+        try:
+            _fast_move(quarantine_file, destination_path)
+        except Exception as e:
+            logger.error(f"Falha ao mover arquivo, removendo INSERT: {e}")
+            try:
+                cursor.execute('DELETE FROM nota_fiscal WHERE id = ?', (nota_id,))
+                conn.commit()
+            except Exception as del_error:
+                conn.rollback()
+                logger.critical(f"FALHA NO DELETE COMPENSATÓRIO (nota id={nota_id}): {del_error}")
+            return False, f"Erro ao mover: {e}", ErrorType.FILE_PERMISSION_ERROR
+
+        _dedup_remember(file_hash, chave_acesso)
+        update_processing_status(audit_id, ProcessingStatus.FILE_MOVED,
+                                chave_acesso=chave_acesso,
+                                empresa_id=empresa_id,
+                                final_destination=str(destination_path))
+
+        # FASE 8: Marcar como sucesso
+        duration_ms = int((time.time() - start_time) * 1000)
+        update_processing_status(
+            audit_id,
+            ProcessingStatus.SUCCESS,
+            final_destination=str(destination_path),
+            completed_at=datetime.now().isoformat(),
+            total_duration_ms=duration_ms
+        )
+        
+        audit_log('FILE_PROCESSED_SUCCESS', {
+            'audit_id': audit_id,
+            'chave': chave_acesso,
+            'empresa_id': empresa_id,
+            'destination': str(destination_path),
+            'duration_ms': duration_ms
+        })
+        
+        return True, None, None
+        
+    except Exception as e:
+        error_msg = f"Erro inesperado: {str(e)}"
+        logger.exception(error_msg)
+        return False, error_msg, ErrorType.UNKNOWN_ERROR
+
+def process_single_file_with_retry(source_file: Path) -> dict:
+    """
+    Processa um arquivo com retry automático e auditoria completa.
+    
+    Fluxo:
+    1. Calcula hash inicial
+    2. Pré-filtro de duplicata por hash (sai cedo se já processado)
+    3. Cria registro de auditoria
+    4. Move para quarentena (staging)
+    5. Tenta processar com retry exponencial
+    6. Se falhar permanentemente, move para dead letter
+    """
+    result = {
+        "file": source_file.name,
+        "status": "erro",
+        "audit_id": None,
+        "attempts": 0
+    }
+    
+    try:
+        # 1. Hash inicial (enquanto ainda está no source)
+        file_hash = calculate_file_hash(source_file)
+        if not file_hash:
+            logger.error(f"Impossível calcular hash: {source_file.name}")
+            return result
+        
+        # 2. Pré-filtro de duplicata: num rescan de diretório já processado a
+        # maioria dos arquivos é repetida — detectar aqui (Bloom + banco, sem
+        # segunda leitura) evita quarentena, parse e o maquinário de retry.
+        # O INSERT da FASE 5 continua cobrindo a corrida residual.
+        if _nota_exists('hash_arquivo', file_hash):
+            audit_id = create_processing_record(source_file, file_hash)
+            if audit_id:
+                result["audit_id"] = audit_id
+                update_processing_status(audit_id, ProcessingStatus.DUPLICATE)
+            try:
+                source_file.unlink()
+            except OSError as e:
+                logger.warning(f"Falha ao remover duplicata {source_file.name}: {e}")
+            result["status"] = "duplicado"
+            return result
+
+        # 3. Criar registro de auditoria
+        audit_id = create_processing_record(source_file, file_hash)
+        if not audit_id:
+            logger.error(f"Impossível criar registro de auditoria: {source_file.name}")
+            return result
+        
+        result["audit_id"] = audit_id
+        
+        # 4. Mover para quarentena (CRÍTICO)
+        quarantine_file = move_to_quarantine(source_file)
+        if not quarantine_file:
+            update_processing_status(audit_id, ProcessingStatus.FAILED_PERMANENT,
+                                    error_type=ErrorType.FILE_PERMISSION_ERROR,
+                                    error_message="Falha ao mover para quarentena")
+            return result
+        
+        update_processing_status(audit_id, ProcessingStatus.QUARANTINED)
+        
+        # 5. Tentar processar com retry
+        for attempt in range(1, MAX_RETRY_ATTEMPTS + 1):
+            result["attempts"] = attempt
+            
+            logger.info(f"→ Processando {quarantine_file.name} (tentativa {attempt}/{MAX_RETRY_ATTEMPTS})")
+            
+            update_processing_status(audit_id, ProcessingStatus.PROCESSING)
+            
+            success, error_msg, error_type = atomic_process_file(quarantine_file, audit_id, attempt,
+                                                                file_hash=file_hash)
+            
+            # Registrar tentativa
+            status = ProcessingStatus.SUCCESS if success else ProcessingStatus.FAILED_MOVE
+            record_attempt(audit_id, attempt, status, error_type, error_msg,
+                         traceback.format_exc() if not success else None)
+            
+            if success:
+                # atomic_process_file sinaliza duplicata via error_msg mesmo
+                # retornando sucesso — propaga o status canônico para o lote
+                result["status"] = "duplicado" if error_msg else "sucesso"
+                logger.info(f"✓ {quarantine_file.name} processado com sucesso")
+                return result
+            
+            # Se falhou, verificar se deve tentar novamente
+            if attempt < MAX_RETRY_ATTEMPTS:
+                delay = RETRY_DELAY_BASE ** attempt  # Backoff exponencial
+                logger.warning(f"⚠ Tentativa {attempt} falhou: {error_msg}. Tentando novamente em {delay}s...")
+                time.sleep(delay)
+            else:
+                # Esgotou tentativas
+                logger.error(f"✗ FALHA PERMANENTE após {MAX_RETRY_ATTEMPTS} tentativas: {quarantine_file.name}")
+                
+                # Mover para dead letter queue
+                dead_letter_file = DEAD_LETTER_DIRECTORY / quarantine_file.name
+                try:
+                    _fast_move(quarantine_file, dead_letter_file)
+                    update_processing_status(audit_id, ProcessingStatus.FAILED_PERMANENT,
+                                            error_type=error_type,
+                                            error_message=error_msg,
+                                            final_destination=str(dead_letter_file))
+                    
+                    audit_log('FILE_DEAD_LETTER', {
+                        'audit_id': audit_id,
+                        'file': quarantine_file.name,
+                        'attempts': MAX_RETRY_ATTEMPTS,
+                        'final_error': error_msg
+                    })
+                except Exception as e:
+                    logger.critical(f"CRÍTICO: Falha ao mover para dead letter: {e}")
+        
+        return result
+        
+    except Exception:
+        # logger.exception só formata o traceback se algum handler for emitir
+        logger.exception(f"Erro crítico no processamento de {source_file.name}")
+        return result
+
+# ============================================================================
+# PROCESSAMENTO EM LOTE
+# ============================================================================
+
+# Pool único de workers para todos os lotes e ciclos: criar/destruir um
+# ThreadPoolExecutor por lote desperdiçava o spawn das threads — justamente o
+# custo que um pool existe para amortizar. Criado sob demanda como o pool de
+# parse; encerrado no shutdown do main.
+_file_pool: Optional[ThreadPoolExecutor] = None
+_file_pool_lock = Lock()
+
+def _get_file_pool() -> ThreadPoolExecutor:
+    global _file_pool
+    if _file_pool is None:
+        with _file_pool_lock:
+            if _file_pool is None:
+                _file_pool = ThreadPoolExecutor(
+                    max_workers=MAX_WORKERS, thread_name_prefix='xmlw'
+                )
+    return _file_pool
+
+# Status canônicos dos workers → contador do lote; qualquer valor
+# desconhecido cai no balde de erro
+_STATUS_BUCKET = {
+    "sucesso": "sucesso",
+    "duplicado": "duplicado",
+}
+
+# Chaves dos contadores de lote/ciclo, fixadas uma vez: a agregação itera a
+# tupla em vez de redescobrir as chaves do dict a cada lote
+_STATS_KEYS = ("sucesso", "duplicado", "erro", "total_attempts")
+
+def process_batch(xml_files: List[Path]) -> dict:
+    """Processa lote de arquivos com controle de erro."""
+    stats = dict.fromkeys(_STATS_KEYS, 0)
+
+    executor = _get_file_pool()
+
+    def _tally(future):
+        # Sem timeout individual: o prazo é do lote (deadline abaixo), e os
+        # futures só chegam aqui já completados pelo wait()
+        try:
+            result = future.result()
+
+            stats["total_attempts"] += result.get("attempts", 0)
+            stats[_STATUS_BUCKET.get(result["status"], "erro")] += 1
+
+        except Exception as e:
+            stats["erro"] += 1
+            logger.error(f"Erro no future: {e}")
+
+    # Janela deslizante de submissão: em vez de materializar um Future por
+    # arquivo antes de qualquer trabalho começar, mantém no máximo
+    # MAX_WORKERS*2 tarefas em voo — memória de pico limitada e os workers
+    # nunca ficam ociosos esperando a submissão terminar.
+    #
+    # O prazo é único por lote: um result(timeout=60) por future permitia a
+    # um lote degenerado travar 60s vezes o tamanho do lote; com a deadline o
+    # pior caso é BATCH_TIMEOUT, e os wakeups são um por wait() em vez de um
+    # por future.
+    max_inflight = MAX_WORKERS * 2
+    window: deque = deque()
+    deadline = time.monotonic() + BATCH_TIMEOUT
+    submitted = 0
+
+    for f in xml_files:
+        if len(window) >= max_inflight:
+            done, _ = wait(window, timeout=max(0.0, deadline - time.monotonic()),
+                           return_when=FIRST_COMPLETED)
+            if not done:
+                break  # prazo do lote estourado com a janela cheia
+            window = deque(fut for fut in window if fut not in done)
+            for fut in done:
+                _tally(fut)
+        window.append(executor.submit(process_single_file_with_retry, f))
+        submitted += 1
+
+    done, pending = wait(window, timeout=max(0.0, deadline - time.monotonic()))
+    for future in done:
+        _tally(future)
+
+    if pending:
+        for future in pending:
+            future.cancel()
+        stats["erro"] += len(pending)
+        logger.error(
+            f"⚠ Lote estourou o prazo de {BATCH_TIMEOUT}s: "
+            f"{len(pending)} tarefa(s) abandonadas"
+        )
+    if submitted < len(xml_files):
+        # Arquivos não submetidos continuam na origem e voltam no próximo scan
+        logger.warning(f"⚠ {len(xml_files) - submitted} arquivo(s) ficaram para o próximo ciclo")
+
+    return stats
+
+def _scan_xml_files(root: Path):
+    """
+    Varredura recursiva via os.scandir: um file descriptor por diretório e
+    filtro por sufixo de nome, sem o custo de fnmatch e da construção de um
+    Path + stat por entrada que o rglob do pathlib paga.
+    """
+    stack = [str(root)]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.name.endswith('.xml') and entry.is_file(follow_symlinks=False):
+                        yield Path(entry.path)
+        except OSError as e:
+            logger.warning(f"Erro ao varrer {current}: {e}")
+
+class _NewFileSignal(FileSystemEventHandler):
+    """Handler watchdog: acorda o loop principal quando um XML novo aparece."""
+
+    def __init__(self, wakeup: "queue.Queue"):
+        self._wakeup = wakeup
+
+    def _signal(self, path: str):
+        if path.endswith('.xml'):
+            try:
+                self._wakeup.put_nowait(path)
+            except queue.Full:
+                pass  # o loop já vai acordar de qualquer forma
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self._signal(event.src_path)
+
+    def on_moved(self, event):
+        if not event.is_directory:
+            self._signal(event.dest_path)
+
+def start_file_watcher(wakeup: "queue.Queue"):
+    """Inicia o observer inotify se o watchdog estiver instalado."""
+    if Observer is None:
+        return None
+    try:
+        observer = Observer()
+        observer.schedule(_NewFileSignal(wakeup), str(SOURCE_DIRECTORY), recursive=True)
+        observer.daemon = True
+        observer.start()
+        logger.info("✓ Monitoramento por inotify ativo (watchdog)")
+        return observer
+    except Exception as e:
+        logger.warning(f"Watchdog indisponível, usando apenas polling: {e}")
+        return None
+
+def _iter_xml_batches(root: Path, batch_size: int):
+    """
+    Agrupa a varredura em lotes de batch_size sem materializar a lista
+    completa: o primeiro lote entra em processamento enquanto o scandir
+    ainda percorre o resto da árvore.
+    """
+    batch = []
+    for path in _scan_xml_files(root):
+        batch.append(path)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def scan_and_process() -> int:
+    """Escaneia diretório de origem e processa arquivos; retorna o total encontrado."""
+    if not SOURCE_DIRECTORY.exists():
+        logger.error(f"Diretório de origem não encontrado: {SOURCE_DIRECTORY}")
+        return 0
+
+    start_time = time.time()
+    total_stats = dict.fromkeys(_STATS_KEYS, 0)
+    batch_num = 0
+    total = 0
+    processed = 0
+    bulk_mode = False
+    last_log_t = 0.0
+
+    try:
+        for batch in _iter_xml_batches(SOURCE_DIRECTORY, BATCH_SIZE):
+            batch_num += 1
+            total += len(batch)
+
+            # Ingest em massa (carga inicial, represamento): suspende os
+            # índices secundários assim que o volume passa do limiar
+            if not bulk_mode and total >= BULK_MODE_THRESHOLD:
+                begin_bulk_mode()
+                bulk_mode = True
+
+            stats = process_batch(batch)
+
+            for key in _STATS_KEYS:
+                total_stats[key] += stats[key]
+
+            processed = total_stats["sucesso"] + total_stats["duplicado"] + total_stats["erro"]
+
+            # Log de progresso com throttle: uma linha a cada 2s no máximo —
+            # com lotes pequenos e rápidos, formatar e emitir por lote vira
+            # custo mensurável. O resumo final reporta os totais de qualquer
+            # forma; %-format deixa a montagem da string para o handler.
+            now = time.time()
+            if now - last_log_t >= 2.0 and logger.isEnabledFor(logging.INFO):
+                last_log_t = now
+                elapsed = now - start_time
+                rate = processed / elapsed if elapsed > 0 else 0
+                logger.info(
+                    "✓ Lote %d: %d ok | %d dup | %d erro | %d tentativas | "
+                    "%d processados (%.1f arq/s)",
+                    batch_num, stats['sucesso'], stats['duplicado'],
+                    stats['erro'], stats['total_attempts'], processed, rate
+                )
+    finally:
+        if bulk_mode:
+            end_bulk_mode()
+
+    if total == 0:
+        return 0
+
+    # Garante que toda a auditoria acumulada do ciclo chegue ao disco
+    audit_writer.flush()
+
+    elapsed = time.time() - start_time
+    if processed > 0:
+        logger.info(
+            f"✓ CONCLUÍDO: {total_stats['sucesso']} novos | "
+            f"{total_stats['duplicado']} duplicados | {total_stats['erro']} erros | "
+            f"{total_stats['total_attempts']} tentativas | "
+            f"Tempo: {elapsed:.1f}s | Taxa: {total/elapsed:.1f} arq/s"
+        )
+
+    return total
+
+# ============================================================================
+# RECONCILIAÇÃO E RECOVERY
+# ============================================================================
+
+def reconcile_processing_queue():
+    """
+    Verifica arquivos que ficaram presos em estados intermediários e tenta recuperá-los.
+    Executa periodicamente para garantir que nenhum arquivo seja esquecido.
+    """
+    global _needs_reconcile
+    try:
+        # Snapshot único dos diretórios de interesse: um readdir por diretório
+        # por ciclo, capturando nome e st_mtime juntos (o scandir já traz o
+        # stat de graça na maioria dos filesystems). As três fases abaixo
+        # consultam este índice em memória em vez de revisitar o disco.
+        dir_index = {}
+        for directory in (QUARANTINE_DIRECTORY, PROCESSING_DIRECTORY,
+                          FAILED_DIRECTORY, DEAD_LETTER_DIRECTORY):
+            entries = {}
+            try:
+                with os.scandir(directory) as it:
+                    for entry in it:
+                        if entry.is_file(follow_symlinks=False):
+                            entries[entry.name] = entry.stat().st_mtime
+            except OSError as e:
+                logger.warning(f"Erro ao listar {directory}: {e}")
+            dir_index[directory] = entries
+
+        # Fast-path: diretórios vazios e nenhuma escrita de auditoria desde a
+        # última reconciliação limpa — nada pode ter ficado preso, então o
+        # ciclo inteiro (flush, consulta, transação e log) é dispensado
+        if not _needs_reconcile and not any(dir_index.values()):
+            logger.info("✓ Reconciliação: nada mudou desde o último ciclo")
+            return
+
+        logger.info("🔍 Iniciando reconciliação...")
+
+        # A reconciliação lê processing_audit: descarrega o buffer antes
+        audit_writer.flush()
+
+        issues_found = []
+        issues_fixed = 0
+
+        # 1. Verificar arquivos em quarentena que não têm registro de processamento recente
+        quarantine_mtimes = dir_index[QUARANTINE_DIRECTORY]
+        quarantine_files = [QUARANTINE_DIRECTORY / name
+                            for name in quarantine_mtimes if name.endswith('.xml')]
+        if quarantine_files:
+            logger.warning(f"⚠ {len(quarantine_files)} arquivo(s) em quarentena precisam atenção")
+
+            now = time.time()
+            for qfile in quarantine_files:
+                # Verificar quanto tempo está em quarentena (mtime do snapshot)
+                file_age_seconds = now - quarantine_mtimes[qfile.name]
+
+                if file_age_seconds > 300:  # Mais de 5 minutos
+                    logger.warning(f"⚠ Arquivo preso em quarentena: {qfile.name} ({file_age_seconds:.0f}s)")
+                    issues_found.append(f"Quarantine stuck: {qfile.name}")
+                    
+                    # Tentar processar novamente
+                    try:
+                        result = process_single_file_with_retry(qfile)
+                        if result["status"] == "sucesso":
+                            issues_fixed += 1
+                    except Exception as e:
+                        logger.error(f"Erro ao recuperar {qfile.name}: {e}")
+        
+        # 2. Verificar registros no BD com status intermediário.
+        # A consulta usa a conexão somente-leitura persistente: em WAL ela não
+        # disputa lock com o escritor, e as escritas ficam para o final.
+        cursor = get_ro_conn().cursor()
+
+        # Corte calculado em Python e passado como parâmetro: embrulhar
+        # last_attempt_at em datetime() no WHERE inutilizava o índice composto
+        # e forçava full scan; com a comparação direta de strings ISO a query
+        # vira um range scan em idx_audit_status_attempt. CURRENT_TIMESTAMP
+        # grava em UTC, então o corte também é UTC.
+        cutoff = (datetime.utcnow() - timedelta(minutes=10)).strftime('%Y-%m-%d %H:%M:%S')
+        cursor.execute(SQL_SELECT_STUCK, (*_STUCK_STATUSES, cutoff))
+
+        stuck_records = cursor.fetchall()
+
+        lost_records = []
+        if stuck_records:
+            logger.warning(f"⚠ {len(stuck_records)} registro(s) com status intermediário antigo")
+
+            # Existência resolvida contra o snapshot: pertencimento em set,
+            # zero syscall por registro
+            known_files = set()
+            for directory in (QUARANTINE_DIRECTORY, PROCESSING_DIRECTORY, FAILED_DIRECTORY):
+                known_files.update(dir_index[directory])
+
+            for record_id, filename, status, _last_attempt, _attempt_count in stuck_records:
+                logger.warning(f"⚠ Registro preso: ID={record_id}, {filename}, status={STATUS_NAMES.get(status, status)}")
+                issues_found.append(f"DB stuck: {filename} ({STATUS_NAMES.get(status, status)})")
+
+                if filename not in known_files:
+                    logger.error(f"✗ Arquivo perdido: {filename} (ID={record_id})")
+                    lost_records.append((ProcessingStatus.FAILED_PERMANENT.value, record_id))
+
+        # 3. Verificar dead letter queue (contagem a partir do snapshot)
+        dead_letter_count = sum(
+            1 for name in dir_index[DEAD_LETTER_DIRECTORY] if name.endswith('.xml')
+        )
+        if dead_letter_count:
+            logger.warning(f"⚠ {dead_letter_count} arquivo(s) em dead letter queue")
+            issues_found.append(f"Dead letter: {dead_letter_count} files")
+
+        # Todas as escritas do ciclo (marcação de perdidos + log) na conexão
+        # persistente desta thread, em uma transação única: um fsync por
+        # reconciliação em vez de um por commit
+        conn = get_conn()
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            if lost_records:
+                cursor.executemany(SQL_MARK_LOST, lost_records)
+
+            # 4. Registrar resultado da reconciliação
+            cursor.execute('''
+                INSERT INTO reconciliation_log
+                (files_checked, inconsistencies_found, issues_fixed, details)
+                VALUES (?, ?, ?, ?)
+            ''', (
+                len(quarantine_files) + len(stuck_records),
+                len(issues_found),
+                issues_fixed,
+                _json_dumps(issues_found)
+            ))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+        # A dispensa do próximo ciclo só vale se não restou registro
+        # intermediário nenhum: um registro existente pode envelhecer até o
+        # corte de 10 minutos sem que nenhuma escrita nova aconteça
+        remaining = get_ro_conn().execute(
+            SQL_COUNT_INTERMEDIATE, _STUCK_STATUSES
+        ).fetchone()[0]
+        if remaining == 0:
+            _needs_reconcile = False
+
+        if issues_found:
+            logger.warning(f"⚠ Reconciliação: {len(issues_found)} problema(s), {issues_fixed} corrigido(s)")
+        else:
+            logger.info("✓ Reconciliação: Nenhum problema encontrado")
+        
+        audit_log('RECONCILIATION_COMPLETED', {
+            'issues_found': len(issues_found),
+            'issues_fixed': issues_fixed,
+            'details': issues_found
+        })
+        
+    except Exception:
+        logger.exception("Erro na reconciliação")
+
+# ============================================================================
+# MAIN
+# ============================================================================
+
+def main():
+    """Loop principal do sistema."""
+    logger.info("=" * 80)
+    logger.info("XML ORGANIZER v3.0 - ULTRA-CONFIÁVEL")
+    logger.info(f"Monitorando: {SOURCE_DIRECTORY}")
+    logger.info(f"Destino: {DESTINATION_NETWORK_DIRECTORY}")
+    logger.info(f"Quarentena: {QUARANTINE_DIRECTORY}")
+    logger.info(f"Dead Letter: {DEAD_LETTER_DIRECTORY}")
+    logger.info(f"Banco de dados: {DATABASE_FILE}")
+    logger.info(f"Workers: {MAX_WORKERS} | Batch: {BATCH_SIZE} | Max Retry: {MAX_RETRY_ATTEMPTS}")
+    logger.info("=" * 80)
+    
+    setup_database()
+    migrate_old_database()
+    load_caches()
+
+    # Cria o pool de processos de parse agora, enquanto só existem as threads
+    # de infraestrutura — forkar depois, com 32+ workers vivos, arrisca herdar
+    # locks presos no filho (deadlock silencioso no primeiro log/commit)
+    _get_parse_pool()
+
+
+    logger.info("\n🛡️ CAMADAS DE PROTEÇÃO ATIVAS:")
+    logger.info("  1. ✓ Quarentena antes de processar")
+    logger.info("  2. ✓ Retry automático com backoff exponencial")
+    logger.info("  3. ✓ Transação atômica (BD + arquivo)")
+    logger.info("  4. ✓ Auditoria completa de tentativas")
+    logger.info("  5. ✓ Dead Letter Queue para falhas permanentes")
+    logger.info("  6. ✓ Reconciliação periódica")
+    logger.info("  7. ✓ Recovery automático\n")
+    
+    audit_log('SYSTEM_STARTED', {'version': '3.0'})
+    
+    cycle = 0
+    last_reconciliation = time.time()
+
+    # Com watchdog instalado, XMLs novos acordam o loop imediatamente;
+    # o polling por SCAN_INTERVAL permanece como rede de segurança.
+    wakeup_queue: "queue.Queue" = queue.Queue(maxsize=1000)
+    observer = start_file_watcher(wakeup_queue)
+
+    # Backoff adaptativo: ciclos vazios dobram o intervalo de polling (até
+    # MAX_SCAN_INTERVAL); trabalho encontrado ou evento do watchdog resetam
+    current_interval = SCAN_INTERVAL
+
+    while True:
+        try:
+            cycle += 1
+
+            # Processar arquivos
+            found = scan_and_process()
+            if found:
+                current_interval = SCAN_INTERVAL
+            else:
+                current_interval = min(current_interval * 2, MAX_SCAN_INTERVAL)
+
+            # Reconciliação periódica
+            if time.time() - last_reconciliation > RECONCILIATION_INTERVAL:
+                reconcile_processing_queue()
+                last_reconciliation = time.time()
+
+            # Dorme até o intervalo corrente, mas acorda cedo se chegar arquivo
+            try:
+                wakeup_queue.get(timeout=current_interval)
+                current_interval = SCAN_INTERVAL
+                while True:  # drena eventos acumulados
+                    wakeup_queue.get_nowait()
+            except queue.Empty:
+                pass
+            
+        except KeyboardInterrupt:
+            logger.info("\n⊗ Finalizando por solicitação do usuário")
+            audit_log('SYSTEM_STOPPED', {'reason': 'user_request', 'cycles': cycle})
+            # Ordem importa: primeiro param os produtores (observer e workers,
+            # que enfileiram auditoria), só então o escritor é drenado e
+            # fechado — close() antes dos workers deixaria enqueues tardios
+            # ressuscitarem uma escritora cujo buffer nunca seria drenado.
+            if observer is not None:
+                observer.stop()
+            if _file_pool is not None:
+                _file_pool.shutdown(wait=True)
+            if _parse_pool is not None:
+                _parse_pool.shutdown(wait=False)
+            audit_writer.close()
+            force_checkpoint()
+            _audit_listener.stop()
+            break
+            
+        except Exception as e:
+            logger.exception(f"✗ Erro no ciclo {cycle}")
+            audit_log('SYSTEM_ERROR', {'cycle': cycle, 'error': str(e)})
+            time.sleep(10)
+
+if __name__ == "__main__":
+    main()